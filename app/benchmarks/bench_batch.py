@@ -0,0 +1,83 @@
+"""Memory and time of list-of-dicts rows against the columnar WeatherBatch.
+
+Maps the forecast fixture into synthetic rows for N cities, then runs both
+in-memory pipelines up to the bytes COPY would send to PostgreSQL:
+
+    dicts:    validate_weather_rows -> CSVStream
+    columnar: WeatherBatch.from_rows -> validated() -> batch CSV stream
+
+Peak memory is measured with tracemalloc, which also sees numpy buffers.
+No network or database is needed.
+
+Usage (from the repository root):
+    python app/benchmarks/bench_batch.py [cities ...]
+"""
+import sys
+import time
+import tracemalloc
+
+sys.path.append('app/')
+
+from db.batch import DTYPES, WeatherBatch
+from db.bulk import CSVStream
+from db.schemas import validate_weather_rows
+from utils import read_file
+from workers import ForecastFetcher
+
+COLUMNS = list(DTYPES)
+
+
+def make_responses(cities: int) -> list[list[dict]]:
+    response = read_file('app/tests/fixture_files/sample_forecast.json')
+    return [[ForecastFetcher(1, city, 1, 1)._construct_mapping(item)
+             for item in response['list']] for city in range(cities)]
+
+
+def drain(stream) -> int:
+    size = 0
+    while chunk := stream.read(1 << 16):
+        size += len(chunk)
+    return size
+
+
+def dicts_pipeline(responses: list[list[dict]]) -> int:
+    rows = []
+    for response in responses:
+        rows.extend(validate_weather_rows(response)[0])
+    return drain(CSVStream(rows, COLUMNS))
+
+
+def columnar_pipeline(responses: list[list[dict]]) -> int:
+    batch = WeatherBatch.concat(
+        WeatherBatch.from_rows(response) for response in responses)
+    batch, _ = batch.validated()
+    return drain(batch.csv_stream(COLUMNS))
+
+
+def measure(pipeline, cities: int) -> tuple[float, float]:
+    responses = make_responses(cities)
+    start = time.perf_counter()
+    pipeline(responses)
+    elapsed = time.perf_counter() - start
+
+    responses = make_responses(cities)
+    tracemalloc.start()
+    pipeline(responses)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 2 ** 20
+
+
+def main() -> None:
+    sizes = [int(i) for i in sys.argv[1:]] or [100, 1_000, 2_500]
+    print(f'{"rows":>8} {"dicts, s":>9} {"columnar, s":>12} '
+          f'{"dicts, MiB":>11} {"columnar, MiB":>14}')
+    for cities in sizes:
+        dicts_sec, dicts_mib = measure(dicts_pipeline, cities)
+        columnar_sec, columnar_mib = measure(columnar_pipeline, cities)
+        print(f'{cities * 40:>8} {dicts_sec:>9.2f} {columnar_sec:>12.2f} '
+              f'{dicts_mib:>11.1f} {columnar_mib:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
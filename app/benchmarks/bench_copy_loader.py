@@ -0,0 +1,84 @@
+"""Rows per second of the COPY loader against the executemany insert() path.
+
+Needs a reachable PostgreSQL at settings.DATABASE_URL with migrations
+applied. Writes go to a scratch copy of weather_fact (no foreign keys),
+which is dropped afterwards.
+
+Usage (from the repository root):
+    python app/benchmarks/bench_copy_loader.py [rows ...]
+"""
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import MetaData, Table, insert
+
+sys.path.append('app/')
+
+from db.bulk import write_rows
+from db.session import engine
+
+SCRATCH_TABLE = 'bench_weather_fact'
+
+
+def make_rows(count: int) -> list[dict]:
+    start = datetime(2023, 1, 1)
+    return [{
+        'timestamp': start + timedelta(hours=i // 1000),
+        'city': i % 1000,
+        'condition': 800,
+        'temp': random.uniform(250, 310),
+        'temp_min': random.uniform(250, 310),
+        'temp_max': random.uniform(250, 310),
+        'pressure': random.randint(950, 1050),
+        'humidity': random.randint(0, 100),
+        'wind_speed': random.uniform(0, 20),
+        'wind_direction': random.randint(0, 360),
+        'wind_gust': None,
+        'clouds': random.randint(0, 100),
+    } for i in range(count)]
+
+
+def timed(func, table: Table, rows: list[dict]) -> float:
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f'TRUNCATE {SCRATCH_TABLE}')
+    start = time.perf_counter()
+    with engine.begin() as connection:
+        func(connection, table, rows)
+    return time.perf_counter() - start
+
+
+def insert_path(connection, table: Table, rows: list[dict]) -> None:
+    connection.execute(insert(table), rows)
+
+
+def copy_path(connection, table: Table, rows: list[dict]) -> None:
+    write_rows(connection, table, rows, method='copy')
+
+
+def main() -> None:
+    sizes = [int(i) for i in sys.argv[1:]] or [1_000, 10_000, 100_000]
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            f'CREATE TABLE IF NOT EXISTS {SCRATCH_TABLE} '
+            '(LIKE weather_fact INCLUDING ALL)')
+    table = Table(SCRATCH_TABLE, MetaData(), autoload_with=engine)
+
+    try:
+        print(f'{"rows":>8} {"insert() rows/s":>16} {"COPY rows/s":>14} '
+              f'{"speed-up":>9}')
+        for size in sizes:
+            rows = make_rows(size)
+            insert_sec = timed(insert_path, table, rows)
+            copy_sec = timed(copy_path, table, rows)
+            print(f'{size:>8} {size / insert_sec:>16,.0f} '
+                  f'{size / copy_sec:>14,.0f} '
+                  f'{insert_sec / copy_sec:>8.1f}x')
+    finally:
+        with engine.begin() as connection:
+            connection.exec_driver_sql(f'DROP TABLE {SCRATCH_TABLE}')
+
+
+if __name__ == '__main__':
+    main()
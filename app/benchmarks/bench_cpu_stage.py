@@ -0,0 +1,65 @@
+"""Throughput of parsing and validating forecasts in threads vs processes.
+
+Processes the forecast fixture for a number of cities the way a cycle
+does, once on a thread pool of FETCH_CONCURRENCY threads (everything
+holds the GIL) and once with the CPU stage on CPU_WORKERS processes,
+and checks both give the same rows. No network or database is needed.
+
+Usage (from the repository root):
+    python app/benchmarks/bench_cpu_stage.py [cities] [cpu_workers]
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append('app/')
+
+from db.batch import WeatherBatch
+from settings import FETCH_CONCURRENCY
+from utils import json_loads
+from workers import ForecastFetcher, get_cpu_pool
+
+FIXTURE = 'app/tests/fixture_files/sample_forecast.json'
+
+
+def run_cycle(fetchers: list, content: bytes, cpu_pool) -> WeatherBatch:
+    def process(fetcher):
+        fetcher.columnar = True
+        fetcher.cpu_pool = cpu_pool
+        if cpu_pool is not None:
+            return fetcher._process_in_pool(content)
+        batch, _ = fetcher._process_response(
+            json_loads(content)).validated()
+        return batch
+
+    with ThreadPoolExecutor(FETCH_CONCURRENCY) as threads:
+        return WeatherBatch.concat(threads.map(process, fetchers))
+
+
+def main() -> None:
+    cities = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    with open(FIXTURE, 'rb') as file:
+        content = file.read()
+    fetchers = [ForecastFetcher(1, i, 1, 1) for i in range(cities)]
+    pool = get_cpu_pool(workers)
+    # start the worker processes outside of the measurement
+    run_cycle(fetchers[:workers * 4], content, pool)
+
+    print(f'{cities} forecasts, {os.cpu_count()} cores')
+    results = {}
+    for label, cpu_pool in (('threads', None),
+                            (f'{workers} processes', pool)):
+        started = time.perf_counter()
+        results[label] = run_cycle(fetchers, content, cpu_pool)
+        elapsed = time.perf_counter() - started
+        print(f'{label:<14} {elapsed:7.2f} s '
+              f'{len(results[label]) / elapsed:10.0f} rows/s')
+    first, second = results.values()
+    assert all((first.columns[name] == second.columns[name]).all()
+               for name in first.columns)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Per-cycle latency of the fetch layer with and without connection pooling.
+
+Starts a local HTTP/1.1 mock server that serves the fixture payloads and
+runs one simulated cycle (a weather and a forecast request per city)
+through the Fetcher hierarchy, first with a new connection per request
+(the old module-level requests.get behaviour), then over the shared
+pooled session.
+
+Usage (from the repository root):
+    python app/benchmarks/bench_http_pool.py [cities] [rounds]
+"""
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.append('app/')
+
+import workers
+from workers import ForecastFetcher, WeatherFetcher, run_concurrently
+
+FIXTURES = {
+    '/weather': 'app/tests/fixture_files/sample_weather.json',
+    '/forecast': 'app/tests/fixture_files/sample_forecast.json',
+}
+
+
+class MockAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    payloads: dict[str, bytes] = {}
+
+    def do_GET(self):
+        body = self.payloads.get(self.path.split('?')[0], b'{}')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class UnpooledSession:
+    @staticmethod
+    def get(**kwargs):
+        return requests.get(**kwargs)
+
+
+def start_server() -> ThreadingHTTPServer:
+    for path, filename in FIXTURES.items():
+        with open(filename, 'rb') as file:
+            MockAPIHandler.payloads[path] = file.read()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockAPIHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_cycle(base_url: str, cities: int) -> float:
+    fetchers = []
+    for city_id in range(cities):
+        weather = WeatherFetcher(time.time(), city_id, 1, 1)
+        weather.url = base_url + '/weather'
+        forecast = ForecastFetcher(time.time(), city_id, 1, 1)
+        forecast.url = base_url + '/forecast'
+        fetchers.extend((weather, forecast))
+
+    start = time.perf_counter()
+    run_concurrently(fetchers)
+    return time.perf_counter() - start
+
+
+def bench(label: str, base_url: str, cities: int, rounds: int) -> float:
+    timings = [run_cycle(base_url, cities) for _ in range(rounds)]
+    median = statistics.median(timings)
+    print(f'{label:<10} median {median * 1000:8.1f} ms   '
+          f'min {min(timings) * 1000:8.1f} ms   '
+          f'per request {median / (2 * cities) * 1e6:8.1f} us')
+    return median
+
+
+def main() -> None:
+    cities = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    workers.logger.setLevel('WARNING')
+
+    server = start_server()
+    base_url = 'http://%s:%d' % server.server_address
+    print(f'{cities} cities, {2 * cities} requests per cycle, '
+          f'{rounds} rounds')
+
+    pooled_session = workers.get_http_session
+    workers.get_http_session = UnpooledSession
+    unpooled = bench('unpooled', base_url, cities, rounds)
+    workers.get_http_session = pooled_session
+    pooled = bench('pooled', base_url, cities, rounds)
+    print(f'speed-up: {unpooled / pooled:.2f}x')
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Query latency of the main weather access patterns before/after indexes.
+
+Seeds a scratch copy of weather_fact (primary key only, like the init
+migration) with synthetic hourly rows, times the typical consumer and
+maintenance queries, then adds the indexes from migration c41d7e0f2a86
+and times them again. The scratch table is dropped afterwards.
+
+Needs a reachable PostgreSQL at settings.DATABASE_URL.
+
+Usage (from the repository root):
+    python app/benchmarks/bench_indexes.py [cities] [days]
+"""
+import random
+import statistics
+import sys
+import time
+
+from sqlalchemy import text
+
+sys.path.append('app/')
+
+from db.session import engine
+
+SCRATCH_TABLE = 'bench_weather_indexes'
+SAMPLES = 50
+
+QUERIES = {
+    'last 24h for city': (
+        f'SELECT * FROM {SCRATCH_TABLE} WHERE city = :city '
+        f'AND timestamp >= (SELECT max(timestamp) FROM {SCRATCH_TABLE}) '
+        "- interval '24 hours' ORDER BY timestamp DESC"),
+    'last 48 temps for city': (
+        f'SELECT timestamp, temp, humidity FROM {SCRATCH_TABLE} '
+        'WHERE city = :city ORDER BY timestamp DESC LIMIT 48'),
+    'city delete (cascade)': (
+        f'DELETE FROM {SCRATCH_TABLE} WHERE city = :city'),
+    'condition in use (restrict)': (
+        f'SELECT EXISTS (SELECT 1 FROM {SCRATCH_TABLE} '
+        'WHERE condition = :condition)'),
+}
+
+INDEXES = [
+    f'CREATE INDEX ON {SCRATCH_TABLE} (city, timestamp DESC) '
+    'INCLUDE (temp, temp_min, temp_max, humidity)',
+    f'CREATE INDEX ON {SCRATCH_TABLE} (condition)',
+]
+
+
+def seed(cities: int, days: int) -> None:
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f'DROP TABLE IF EXISTS {SCRATCH_TABLE}')
+        connection.exec_driver_sql(
+            f'CREATE TABLE {SCRATCH_TABLE} (LIKE weather_fact '
+            'INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        connection.exec_driver_sql(
+            f'ALTER TABLE {SCRATCH_TABLE} ADD PRIMARY KEY (timestamp, city)')
+        connection.execute(text(
+            f'INSERT INTO {SCRATCH_TABLE} '
+            '(timestamp, city, condition, temp, temp_min, temp_max, '
+            'pressure, humidity, clouds) '
+            "SELECT ts, city, 800 + city % 5, 260 + random() * 40, "
+            '250 + random() * 20, 290 + random() * 20, '
+            '990 + (random() * 40)::int, (random() * 100)::int, '
+            '(random() * 100)::int '
+            "FROM generate_series(now() - make_interval(days => :days), "
+            "now(), interval '1 hour') AS ts, "
+            'generate_series(1, :cities) AS city'),
+            {'days': days, 'cities': cities})
+        connection.exec_driver_sql(f'ANALYZE {SCRATCH_TABLE}')
+
+
+def measure(cities: int) -> dict[str, float]:
+    timings = {}
+    for label, query in QUERIES.items():
+        samples = []
+        for _ in range(SAMPLES):
+            params = {'city': random.randint(1, cities),
+                      'condition': 700}
+            with engine.connect() as connection:
+                start = time.perf_counter()
+                result = connection.execute(text(query), params)
+                if result.returns_rows:
+                    result.all()
+                samples.append(time.perf_counter() - start)
+                connection.rollback()
+        timings[label] = statistics.median(samples)
+    return timings
+
+
+def main() -> None:
+    cities = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    print(f'seeding {cities} cities x {days * 24} hours')
+    seed(cities, days)
+    try:
+        before = measure(cities)
+        with engine.begin() as connection:
+            for statement in INDEXES:
+                connection.exec_driver_sql(statement)
+            connection.exec_driver_sql(f'ANALYZE {SCRATCH_TABLE}')
+        after = measure(cities)
+    finally:
+        with engine.begin() as connection:
+            connection.exec_driver_sql(f'DROP TABLE {SCRATCH_TABLE}')
+
+    print(f'{"query":<30} {"before, ms":>11} {"after, ms":>10} '
+          f'{"speed-up":>9}')
+    for label in QUERIES:
+        print(f'{label:<30} {before[label] * 1000:>11.2f} '
+              f'{after[label] * 1000:>10.2f} '
+              f'{before[label] / after[label]:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
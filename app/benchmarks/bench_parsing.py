@@ -0,0 +1,60 @@
+"""Per-item cost of decoding, mapping and validating the API fixtures.
+
+Compares the stdlib decoder on the response text with the decoder the
+fetchers use (orjson on raw bytes when it is installed), then times the
+full _process_response of each fetcher on the decoded payload. No network
+or database is needed.
+
+Usage (from the repository root):
+    python app/benchmarks/bench_parsing.py [repeats]
+"""
+import json
+import sys
+import timeit
+
+sys.path.append('app/')
+
+from db.models import CityModel
+from utils import json_loads
+from workers import BatchWeatherFetcher, ForecastFetcher, WeatherFetcher
+
+FIXTURES = 'app/tests/fixture_files/'
+
+CASES = {
+    'weather': ('sample_weather.json', lambda: WeatherFetcher(1, 1, 1, 1)),
+    'group': ('sample_group.json', lambda: BatchWeatherFetcher(
+        1, [CityModel(id=1, owm_id=2643743), CityModel(id=2, owm_id=524901)])),
+    'forecast': ('sample_forecast.json',
+                 lambda: ForecastFetcher(1, 1, 1, 1)),
+}
+
+
+def per_item_us(func, items: int, repeats: int) -> float:
+    best = min(timeit.repeat(func, number=repeats, repeat=5))
+    return best / repeats / items * 1e6
+
+
+def main() -> None:
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    print(f'decoder: {json_loads.__module__}')
+    print(f'{"fixture":<10} {"items":>6} {"json.loads(text)":>17} '
+          f'{"json_loads(bytes)":>18} {"map+validate":>13} {"total":>9}')
+    for label, (filename, make_fetcher) in CASES.items():
+        with open(FIXTURES + filename, 'rb') as file:
+            content = file.read()
+        payload = json_loads(content)
+        items = len(payload.get('list', [payload]))
+        fetcher = make_fetcher()
+
+        stdlib = per_item_us(lambda: json.loads(content.decode()), items,
+                             repeats)
+        fast = per_item_us(lambda: json_loads(content), items, repeats)
+        process = per_item_us(
+            lambda: fetcher._process_response(json_loads(content)), items,
+            repeats) - fast
+        print(f'{label:<10} {items:>6} {stdlib:>14.2f} us {fast:>15.2f} us '
+              f'{process:>10.2f} us {fast + process:>6.2f} us')
+
+
+if __name__ == '__main__':
+    main()
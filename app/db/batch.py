@@ -0,0 +1,254 @@
+import operator
+import sys
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+sys.path.append('/app')
+
+from db.bulk import CSVStream
+from db.schemas import (Cloudiness, Humidity, Pressure, Temperature,
+                        WindDirection, WindSpeed)
+from settings import COPY_CHUNK_ROWS
+
+# one typed array per WeatherModel column
+DTYPES = {
+    'timestamp': 'datetime64[us]',
+    'city': np.int32,
+    'condition': np.int32,
+    'temp': np.float64,
+    'temp_min': np.float64,
+    'temp_max': np.float64,
+    'pressure': np.int32,
+    'humidity': np.int32,
+    'wind_speed': np.float64,
+    'wind_direction': np.int32,
+    'wind_gust': np.float64,
+    'clouds': np.int32,
+}
+
+ROW_GETTER = operator.itemgetter(*DTYPES)
+
+REQUIRED = ('timestamp', 'city')
+TEMPERATURES = ('temp', 'temp_min', 'temp_max')
+
+# the bounds are read off the Annotated types of db.schemas, so both
+# validation paths always agree
+RANGE_TYPES = {
+    'temp': Temperature,
+    'temp_min': Temperature,
+    'temp_max': Temperature,
+    'pressure': Pressure,
+    'humidity': Humidity,
+    'wind_speed': WindSpeed,
+    'wind_direction': WindDirection,
+    'wind_gust': WindSpeed,
+    'clouds': Cloudiness,
+}
+
+OPERATORS = {'gt': operator.gt, 'ge': operator.ge,
+             'lt': operator.lt, 'le': operator.le}
+
+
+def _bounds(annotated) -> list[tuple]:
+    bounds = []
+    for constraint in annotated.__metadata__[0].metadata:
+        for name, check in OPERATORS.items():
+            if hasattr(constraint, name):
+                bounds.append((check, getattr(constraint, name)))
+    return bounds
+
+
+RANGES = {name: _bounds(kind) for name, kind in RANGE_TYPES.items()}
+
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def _micros(value) -> int:
+    # timestamp columns have no time zone, postgres would drop the offset
+    # of an aware value anyway; epoch seconds are read as UTC like pydantic
+    # does
+    if isinstance(value, datetime):
+        return (value.replace(tzinfo=None) - EPOCH) // MICROSECOND
+    if isinstance(value, (int, float)):
+        return round(value * 1_000_000)
+    raise TypeError(value)
+
+
+def _to_array(values: list, dtype) -> tuple[np.ndarray, np.ndarray,
+                                            np.ndarray]:
+    count = len(values)
+    nulls = np.fromiter((v is None for v in values), bool, count)
+    invalid = np.zeros(count, bool)
+    filled = values
+    if nulls.any():
+        filled = [0 if v is None else v for v in values]
+    try:
+        if dtype == DTYPES['timestamp']:
+            # numpy converts datetime objects one by one and very slowly,
+            # plain integers are an order of magnitude cheaper
+            try:
+                micros = [(v - EPOCH) // MICROSECOND for v in filled]
+            except TypeError:
+                micros = [_micros(v) for v in filled]
+            return (np.array(micros, np.int64).view(dtype), nulls, invalid)
+        return np.array(filled, dtype=dtype), nulls, invalid
+    except (TypeError, ValueError, OverflowError):
+        pass
+
+    array = np.zeros(count, dtype=dtype)
+    for i, value in enumerate(filled):
+        try:
+            array[i] = (np.int64(_micros(value)).view(dtype)
+                        if dtype == DTYPES['timestamp'] else value)
+        except (TypeError, ValueError, OverflowError):
+            invalid[i] = True
+    return array, nulls, invalid
+
+
+class WeatherBatch:
+    def __init__(self, columns: dict[str, np.ndarray],
+                 nulls: dict[str, np.ndarray],
+                 invalid: Optional[dict[str, np.ndarray]] = None) -> None:
+        self.columns = columns
+        self.nulls = nulls
+        # only the columns that had unconvertible values are listed
+        self.invalid = invalid or {}
+
+    @classmethod
+    def from_rows(cls, rows: list[dict]) -> 'WeatherBatch':
+        if not rows:
+            return cls({name: np.zeros(0, dtype)
+                        for name, dtype in DTYPES.items()},
+                       {name: np.zeros(0, bool) for name in DTYPES})
+        try:
+            values = list(zip(*map(ROW_GETTER, rows)))
+        except KeyError:
+            values = [[row.get(name) for row in rows] for name in DTYPES]
+
+        columns, nulls, invalid = {}, {}, {}
+        for (name, dtype), column in zip(DTYPES.items(), values):
+            columns[name], nulls[name], bad = _to_array(list(column), dtype)
+            if bad.any():
+                invalid[name] = bad
+        return cls(columns, nulls, invalid)
+
+    @classmethod
+    def concat(cls, batches: Iterable['WeatherBatch']) -> 'WeatherBatch':
+        batches = [b for b in batches if len(b)]
+        if not batches:
+            return cls.from_rows([])
+        invalid = {
+            name: np.concatenate([b.invalid.get(name, np.zeros(len(b), bool))
+                                  for b in batches])
+            for name in {name for b in batches for name in b.invalid}}
+        return cls(*({name: np.concatenate([getattr(b, part)[name]
+                                            for b in batches])
+                      for name in DTYPES}
+                     for part in ('columns', 'nulls')), invalid)
+
+    # sent between processes as one record array and one bit per null
+    # instead of two dozen small arrays
+    def __getstate__(self) -> tuple:
+        names = list(self.columns)
+        return (np.rec.fromarrays(list(self.columns.values()), names=names),
+                np.packbits(np.stack([self.nulls[n] for n in names]), axis=1),
+                self.invalid)
+
+    def __setstate__(self, state: tuple) -> None:
+        records, nulls, self.invalid = state
+        names = records.dtype.names
+        nulls = np.unpackbits(nulls, axis=1, count=len(records)).astype(bool)
+        self.columns = {name: np.ascontiguousarray(records[name])
+                        for name in names}
+        self.nulls = dict(zip(names, nulls))
+
+    def __len__(self) -> int:
+        return len(self.columns['city'])
+
+    def __getitem__(self, index: int) -> dict:
+        row = {}
+        for name, array in self.columns.items():
+            value = None if self.nulls[name][index] else array[index].item()
+            row[name] = value
+        return row
+
+    def __iter__(self) -> Iterator[dict]:
+        return (self[i] for i in range(len(self)))
+
+    def take(self, mask: np.ndarray) -> 'WeatherBatch':
+        return WeatherBatch(*({name: getattr(self, part)[name][mask]
+                               for name in getattr(self, part)}
+                              for part in ('columns', 'nulls', 'invalid')))
+
+    def validated(self) -> tuple['WeatherBatch', dict[str, int]]:
+        # the same rules as schemas.WeatherRow, one array operation per
+        # check instead of one python call per value
+        failed = {}
+        for name in DTYPES:
+            bad = (self.invalid[name].copy() if name in self.invalid
+                   else np.zeros(len(self), bool))
+            if name in REQUIRED:
+                bad |= self.nulls[name]
+            for check, bound in RANGES.get(name, ()):
+                bad |= ~self.nulls[name] & ~check(self.columns[name], bound)
+            failed[name] = bad
+        failed['temperature'] = ~np.logical_or.reduce(
+            [~self.nulls[t] & (self.columns[t] != 0) for t in TEMPERATURES])
+
+        invalid_rows = np.logical_or.reduce(list(failed.values()))
+        errors = {name: int(bad.sum()) for name, bad in failed.items()
+                  if bad.any()}
+        valid = self.take(~invalid_rows)
+        valid.invalid = {}
+        return valid, errors
+
+    def null_unknown(self, name: str, known: Iterable[int]) -> list[int]:
+        values, nulls = self.columns[name], self.nulls[name]
+        unknown = ~nulls & ~np.isin(values, np.fromiter(known, np.int64))
+        nulls |= unknown
+        return np.unique(values[unknown]).tolist()
+
+    def touched_hours(self) -> set[tuple[int, datetime]]:
+        hours = self.columns['timestamp'].astype('datetime64[h]')
+        return set(zip(self.columns['city'].tolist(),
+                       hours.astype('datetime64[us]').tolist()))
+
+    def csv_stream(self, columns: list[str]) -> 'BatchCSVStream':
+        return BatchCSVStream(self, columns)
+
+
+# the CSV for COPY is rendered a chunk of rows at a time straight from the
+# arrays, no row dicts are built on the way
+class BatchCSVStream(CSVStream):
+    def __init__(self, batch: WeatherBatch, columns: list[str]) -> None:
+        super().__init__((), columns)
+        self._batch = batch
+        self._offset = 0
+
+    def _column(self, name: str, rows: slice) -> list:
+        array = self._batch.columns[name][rows]
+        if name == 'timestamp':
+            values = np.datetime_as_string(array, unit='us').tolist()
+        else:
+            values = array.tolist()
+        nulls = self._batch.nulls[name][rows]
+        if nulls.any():
+            values = ['' if null else value
+                      for value, null in zip(values, nulls.tolist())]
+        return values
+
+    def _fill(self) -> bool:
+        if self._offset >= len(self._batch):
+            return False
+        rows = slice(self._offset, self._offset + COPY_CHUNK_ROWS)
+        self._offset += COPY_CHUNK_ROWS
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._writer.writerows(
+            zip(*(self._column(name, rows) for name in self._columns)))
+        self._pending += self._buffer.getvalue().encode()
+        return True
@@ -0,0 +1,164 @@
+import csv
+import io
+import sys
+from datetime import datetime
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from sqlalchemy import (Connection, Table, and_, column, delete, distinct,
+                        exists, func, insert, literal_column, select, table,
+                        tuple_)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.sql.expression import TableClause
+
+sys.path.append('/app')
+
+from settings import BULK_WRITE_METHOD, COPY_CHUNK_ROWS, ON_CONFLICT_MODE
+
+
+class WriteResult(NamedTuple):
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+    deleted: int = 0
+    spooled: int = 0
+
+
+# file-like CSV view over row dicts for COPY ... FROM STDIN, rows are
+# rendered lazily chunk by chunk instead of as one big string
+class CSVStream:
+    def __init__(self, rows: Iterable[dict], columns: list[str]) -> None:
+        self._rows: Iterator[dict] = iter(rows)
+        self._columns = columns
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator='\n')
+        self._pending = b''
+
+    def _fill(self) -> bool:
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        for _, row in zip(range(COPY_CHUNK_ROWS), self._rows):
+            self._writer.writerow(
+                [_to_csv(row.get(c)) for c in self._columns])
+        chunk = self._buffer.getvalue()
+        self._pending += chunk.encode()
+        return bool(chunk)
+
+    def read(self, size: int = -1) -> bytes:
+        while (size < 0 or len(self._pending) < size) and self._fill():
+            pass
+        if size < 0:
+            size = len(self._pending)
+        chunk, self._pending = self._pending[:size], self._pending[size:]
+        return chunk
+
+
+def _to_csv(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    return value
+
+
+def create_staging(connection: Connection, target: Table,
+                   columns: list[str]) -> TableClause:
+    name = f'_staging_{target.name}'
+    column_list = ', '.join(f'"{c}"' for c in columns)
+    connection.exec_driver_sql(f'DROP TABLE IF EXISTS "{name}"')
+    connection.exec_driver_sql(
+        f'CREATE TEMP TABLE "{name}" ON COMMIT DROP AS '
+        f'SELECT {column_list} FROM "{target.name}" WITH NO DATA')
+    return table(name, *(column(c) for c in columns))
+
+
+def fill_staging(connection: Connection, staging: TableClause,
+                 data: Iterable[dict], method: str) -> None:
+    if method != 'copy':
+        connection.execute(insert(staging), list(data))
+        return
+
+    columns = [c.name for c in staging.columns]
+    column_list = ', '.join(f'"{c}"' for c in columns)
+    # columnar batches render their own CSV
+    stream = (data.csv_stream(columns) if hasattr(data, 'csv_stream')
+              else CSVStream(data, columns))
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f'COPY "{staging.name}" ({column_list}) '
+            'FROM STDIN WITH (FORMAT csv)',
+            stream)
+    finally:
+        cursor.close()
+
+
+def count_existing(connection: Connection, target: Table,
+                   staging: TableClause) -> tuple[int, int]:
+    keys = tuple_(*(staging.c[c.name] for c in target.primary_key))
+    present = exists().where(
+        and_(*(c == staging.c[c.name] for c in target.primary_key)))
+    return connection.execute(select(
+        func.count(distinct(keys)),
+        func.count(distinct(keys)).filter(present))).one()
+
+
+def merge_staging(connection: Connection, target: Table,
+                  staging: TableClause,
+                  on_conflict: Optional[str] = ON_CONFLICT_MODE
+                  ) -> tuple[int, int]:
+    columns = [c.name for c in staging.columns]
+    source = select(*staging.columns)
+    stmt = pg_insert(target)
+    if on_conflict == 'update':
+        # xmax can't tell inserts from updates on partitioned tables, so
+        # count the keys that are already there before merging. A writer
+        # committing the same keys in between moves rows from inserted to
+        # updated or skipped, the split is only approximate then
+        total, existing = count_existing(connection, target, staging)
+        keys = [c.name for c in target.primary_key]
+        values = [c for c in columns if c not in keys]
+        # one row per key, DO UPDATE can't touch the same row twice
+        source = source.distinct(*(staging.c[c] for c in keys))
+        stmt = stmt.from_select(columns, source).on_conflict_do_update(
+            index_elements=keys,
+            set_={c: stmt.excluded[c] for c in values},
+            where=tuple_(*(target.c[c] for c in values)).is_distinct_from(
+                tuple_(*(stmt.excluded[c] for c in values))))
+    else:
+        stmt = stmt.from_select(columns, source).on_conflict_do_nothing()
+
+    written_rows = stmt.returning(literal_column('1')).cte('written')
+    written = connection.execute(
+        select(func.count()).select_from(written_rows)).scalar()
+    inserted = (min(total - existing, written) if on_conflict == 'update'
+                else written)
+    return inserted, written
+
+
+def write_rows(connection: Connection, target: Table, data: list[dict],
+               method: str = BULK_WRITE_METHOD,
+               on_conflict: Optional[str] = ON_CONFLICT_MODE) -> WriteResult:
+    columns = [c.name for c in target.columns if c.name in data[0]]
+    staging = create_staging(connection, target, columns)
+    fill_staging(connection, staging, data, method)
+    inserted, written = merge_staging(connection, target, staging,
+                                      on_conflict)
+    return WriteResult(inserted, written - inserted, len(data) - written)
+
+
+def refresh_rows(connection: Connection, target: Table, data: list[dict],
+                 scope: str, method: str = BULK_WRITE_METHOD) -> WriteResult:
+    columns = [c.name for c in target.columns if c.name in data[0]]
+    staging = create_staging(connection, target, columns)
+    fill_staging(connection, staging, data, method)
+    inserted, written = merge_staging(connection, target, staging, 'update')
+
+    # rows of the refreshed scopes (e.g. cities) that are not in the new
+    # data anymore, everything else in the table is left untouched
+    keys = [c.name for c in target.primary_key]
+    stale = delete(target).where(
+        target.c[scope].in_(select(staging.c[scope])),
+        ~exists().where(and_(*(staging.c[k] == target.c[k] for k in keys))))
+    deleted = connection.execute(stale).rowcount
+    return WriteResult(inserted, written - inserted, len(data) - written,
+                       deleted)
@@ -0,0 +1,26 @@
+"""add owm_id to cities
+
+Revision ID: 3f1a9c2b7d4e
+Revises: e8c84da838c2
+Create Date: 2026-10-18 10:12:41.204518
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = '3f1a9c2b7d4e'
+down_revision: Union[str, None] = 'e8c84da838c2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('cities', sa.Column('owm_id', sa.Integer(), nullable=True))
+    op.create_index('ix_cities_owm_id', 'cities', ['owm_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_cities_owm_id', table_name='cities')
+    op.drop_column('cities', 'owm_id')
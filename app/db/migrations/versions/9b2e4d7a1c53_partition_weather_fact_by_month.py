@@ -0,0 +1,89 @@
+"""partition weather_fact by month
+
+Revision ID: 9b2e4d7a1c53
+Revises: 3f1a9c2b7d4e
+Create Date: 2026-10-18 13:40:02.118734
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = '9b2e4d7a1c53'
+down_revision: Union[str, None] = '3f1a9c2b7d4e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PRECREATE_MONTHS = 2
+
+
+def create_weather_fact(name: str, **kwargs) -> None:
+    op.create_table(name,
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.Column('temp', sa.Float(), nullable=True),
+    sa.Column('temp_min', sa.Float(), nullable=True),
+    sa.Column('temp_max', sa.Float(), nullable=True),
+    sa.Column('pressure', sa.Integer(), nullable=True),
+    sa.Column('humidity', sa.Integer(), nullable=True),
+    sa.Column('wind_speed', sa.Float(), nullable=True),
+    sa.Column('wind_direction', sa.Integer(), nullable=True),
+    sa.Column('wind_gust', sa.Float(), nullable=True),
+    sa.Column('clouds', sa.Integer(), nullable=True),
+    sa.Column('city', sa.Integer(), nullable=False),
+    sa.Column('condition', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['city'], ['cities.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['condition'], ['conditions.id'], ondelete='RESTRICT'),
+    sa.PrimaryKeyConstraint('timestamp', 'city', name=f'{name}_pkey'),
+    sa.CheckConstraint('100 < temp AND temp < 400', name='temp_check'),
+    sa.CheckConstraint('100 < temp_min AND temp_min < 400', name='min_temp_check'),
+    sa.CheckConstraint('100 < temp_max AND temp_max < 400', name='max_temp_check'),
+    sa.CheckConstraint('0 < pressure AND pressure < 2000', name='pressure_check'),
+    sa.CheckConstraint('0 <= humidity AND humidity <= 100', name='humidity_check'),
+    sa.CheckConstraint('0 <= clouds AND clouds <= 100', name='clouds_check'),
+    sa.CheckConstraint('0 <= wind_speed AND wind_speed < 1000', name='wind_speed_check'),
+    sa.CheckConstraint('0 <= wind_direction AND wind_direction <= 360', name='wind_dir_check'),
+    sa.CheckConstraint('0 <= wind_gust AND wind_gust < 1000', name='wind_gust_check'),
+    **kwargs
+    )
+
+
+def upgrade() -> None:
+    op.rename_table('weather_fact', 'weather_fact_old')
+    op.execute('ALTER TABLE weather_fact_old '
+               'RENAME CONSTRAINT weather_fact_pkey TO weather_fact_old_pkey')
+    create_weather_fact('weather_fact',
+                        postgresql_partition_by='RANGE (timestamp)')
+    # one partition per month from the oldest row up to a few months ahead
+    op.execute(f'''
+    DO $$
+    DECLARE
+        month date;
+    BEGIN
+        FOR month IN
+            SELECT generate_series(
+                date_trunc('month', coalesce(
+                    (SELECT min(timestamp) FROM weather_fact_old), now())),
+                date_trunc('month', now())
+                    + interval '{PRECREATE_MONTHS} months',
+                interval '1 month')::date
+        LOOP
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF weather_fact '
+                'FOR VALUES FROM (%L) TO (%L)',
+                'weather_fact_' || to_char(month, 'YYYY_MM'),
+                month, month + interval '1 month');
+        END LOOP;
+    END $$
+    ''')
+    op.execute('INSERT INTO weather_fact SELECT * FROM weather_fact_old')
+    op.drop_table('weather_fact_old')
+
+
+def downgrade() -> None:
+    op.rename_table('weather_fact', 'weather_fact_partitioned')
+    op.execute('ALTER TABLE weather_fact_partitioned RENAME CONSTRAINT '
+               'weather_fact_pkey TO weather_fact_partitioned_pkey')
+    create_weather_fact('weather_fact')
+    op.execute('INSERT INTO weather_fact SELECT * FROM weather_fact_partitioned')
+    op.drop_table('weather_fact_partitioned')
@@ -0,0 +1,28 @@
+"""add query_name to cities
+
+Revision ID: a4d9e2f7b1c8
+Revises: f2b6c8d4e0a3
+Create Date: 2026-10-18 19:05:44.129736
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = 'a4d9e2f7b1c8'
+down_revision: Union[str, None] = 'f2b6c8d4e0a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('cities', sa.Column('query_name', sa.String(length=100),
+                                      nullable=True))
+    op.create_index(op.f('ix_cities_query_name'), 'cities', ['query_name'],
+                    unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_cities_query_name'), table_name='cities')
+    op.drop_column('cities', 'query_name')
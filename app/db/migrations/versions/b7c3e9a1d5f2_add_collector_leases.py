@@ -0,0 +1,31 @@
+"""add collector_leases
+
+Revision ID: b7c3e9a1d5f2
+Revises: a4d9e2f7b1c8
+Create Date: 2026-10-18 20:41:12.308215
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = 'b7c3e9a1d5f2'
+down_revision: Union[str, None] = 'a4d9e2f7b1c8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('collector_leases',
+    sa.Column('worker_id', sa.String(length=100), nullable=False),
+    sa.Column('started_at', sa.DateTime(), server_default=sa.text('now()'),
+              nullable=False),
+    sa.Column('heartbeat_at', sa.DateTime(), server_default=sa.text('now()'),
+              nullable=False),
+    sa.PrimaryKeyConstraint('worker_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('collector_leases')
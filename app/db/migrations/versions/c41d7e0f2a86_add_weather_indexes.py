@@ -0,0 +1,38 @@
+"""add weather indexes
+
+Revision ID: c41d7e0f2a86
+Revises: 9b2e4d7a1c53
+Create Date: 2026-10-18 15:02:57.530211
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = 'c41d7e0f2a86'
+down_revision: Union[str, None] = '9b2e4d7a1c53'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_weather_fact_city_timestamp', 'weather_fact',
+                    ['city', sa.text('timestamp DESC')],
+                    postgresql_include=['temp', 'temp_min', 'temp_max',
+                                        'humidity'])
+    op.create_index('ix_weather_fact_condition', 'weather_fact',
+                    ['condition'])
+    op.create_index('ix_weather_forecast_city_timestamp', 'weather_forecast',
+                    ['city', 'timestamp'])
+    op.create_index('ix_weather_forecast_condition', 'weather_forecast',
+                    ['condition'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_weather_forecast_condition',
+                  table_name='weather_forecast')
+    op.drop_index('ix_weather_forecast_city_timestamp',
+                  table_name='weather_forecast')
+    op.drop_index('ix_weather_fact_condition', table_name='weather_fact')
+    op.drop_index('ix_weather_fact_city_timestamp', table_name='weather_fact')
@@ -0,0 +1,28 @@
+"""add api_usage
+
+Revision ID: c8d2f4a6e1b9
+Revises: b7c3e9a1d5f2
+Create Date: 2026-10-19 10:12:37.914402
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = 'c8d2f4a6e1b9'
+down_revision: Union[str, None] = 'b7c3e9a1d5f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('api_usage',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('calls', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('day')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('api_usage')
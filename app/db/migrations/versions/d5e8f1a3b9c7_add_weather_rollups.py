@@ -0,0 +1,44 @@
+"""add weather rollups
+
+Revision ID: d5e8f1a3b9c7
+Revises: c41d7e0f2a86
+Create Date: 2026-10-18 16:21:09.884102
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = 'd5e8f1a3b9c7'
+down_revision: Union[str, None] = 'c41d7e0f2a86'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+ROLLUP_TABLES = ('weather_rollup_hourly', 'weather_rollup_daily',
+                 'weather_rollup_monthly')
+
+
+def upgrade() -> None:
+    for name in ROLLUP_TABLES:
+        op.create_table(name,
+        sa.Column('city', sa.Integer(), nullable=False),
+        sa.Column('bucket', sa.DateTime(), nullable=False),
+        sa.Column('temp_min', sa.Float(), nullable=True),
+        sa.Column('temp_max', sa.Float(), nullable=True),
+        sa.Column('temp_sum', sa.Float(), nullable=True),
+        sa.Column('temp_count', sa.Integer(), nullable=False),
+        sa.Column('temp_mean', sa.Float(), sa.Computed('temp_sum / NULLIF(temp_count, 0)', persisted=True)),
+        sa.Column('humidity_min', sa.Integer(), nullable=True),
+        sa.Column('humidity_max', sa.Integer(), nullable=True),
+        sa.Column('humidity_sum', sa.BigInteger(), nullable=True),
+        sa.Column('humidity_count', sa.Integer(), nullable=False),
+        sa.Column('humidity_mean', sa.Float(), sa.Computed('humidity_sum::float / NULLIF(humidity_count, 0)', persisted=True)),
+        sa.ForeignKeyConstraint(['city'], ['cities.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('city', 'bucket')
+        )
+
+
+def downgrade() -> None:
+    for name in reversed(ROLLUP_TABLES):
+        op.drop_table(name)
@@ -0,0 +1,28 @@
+"""add fetch_interval_sec to cities
+
+Revision ID: e7a0b3c6d2f1
+Revises: d5e8f1a3b9c7
+Create Date: 2026-10-18 17:48:30.416925
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = 'e7a0b3c6d2f1'
+down_revision: Union[str, None] = 'd5e8f1a3b9c7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('cities', sa.Column('fetch_interval_sec', sa.Integer(),
+                                      nullable=True))
+    op.create_check_constraint('fetch_interval_check', 'cities',
+                               'fetch_interval_sec > 0')
+
+
+def downgrade() -> None:
+    op.drop_constraint('fetch_interval_check', 'cities', type_='check')
+    op.drop_column('cities', 'fetch_interval_sec')
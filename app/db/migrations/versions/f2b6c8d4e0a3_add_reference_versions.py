@@ -0,0 +1,52 @@
+"""add reference_versions
+
+Revision ID: f2b6c8d4e0a3
+Revises: e7a0b3c6d2f1
+Create Date: 2026-10-18 18:32:07.551093
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = 'f2b6c8d4e0a3'
+down_revision: Union[str, None] = 'e7a0b3c6d2f1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+REFERENCE_TABLES = ('cities', 'conditions')
+
+
+def upgrade() -> None:
+    op.create_table('reference_versions',
+    sa.Column('table_name', sa.String(length=50), nullable=False),
+    sa.Column('version', sa.BigInteger(), server_default='0',
+              nullable=False),
+    sa.PrimaryKeyConstraint('table_name')
+    )
+    op.execute('''
+        CREATE FUNCTION bump_reference_version() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO reference_versions (table_name, version)
+            VALUES (TG_TABLE_NAME, 1)
+            ON CONFLICT (table_name)
+            DO UPDATE SET version = reference_versions.version + 1;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    for name in REFERENCE_TABLES:
+        op.execute(f"INSERT INTO reference_versions VALUES ('{name}', 0)")
+        op.execute(f'''
+            CREATE TRIGGER {name}_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {name}
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_reference_version()
+        ''')
+
+
+def downgrade() -> None:
+    for name in REFERENCE_TABLES:
+        op.execute(f'DROP TRIGGER {name}_version ON {name}')
+    op.execute('DROP FUNCTION bump_reference_version()')
+    op.drop_table('reference_versions')
@@ -1,8 +1,9 @@
 import sys
 
-from sqlalchemy import (CheckConstraint, Column, DateTime, Float, ForeignKey,
-                        Integer, PrimaryKeyConstraint, String,
-                        UniqueConstraint)
+from sqlalchemy import (BigInteger, CheckConstraint, Column, Computed,
+                        Date, DateTime, Float, ForeignKey, Index, Integer,
+                        PrimaryKeyConstraint, String, UniqueConstraint, func,
+                        text)
 from sqlalchemy.orm import declarative_base
 
 sys.path.append('/app')
@@ -21,6 +22,10 @@ class CityModel(Base):
     state = Column(String(50))
     latitude = Column(Float)
     longitude = Column(Float)
+    owm_id = Column(Integer, index=True)
+    fetch_interval_sec = Column(Integer)
+    # the name from cities.json the row was geocoded from
+    query_name = Column(String(100), unique=True, index=True)
     UniqueConstraint('name', 'country')
     CheckConstraint(
         f'{CONSTR["MIN_LAT_DEG"]} <= latitude AND '
@@ -40,6 +45,32 @@ class ConditionModel(Base):
     description = Column(String(50))
 
 
+# bumped by triggers on every statement that changes a reference table
+class ReferenceVersionModel(Base):
+    __tablename__ = 'reference_versions'
+
+    table_name = Column(String(50), primary_key=True)
+    version = Column(BigInteger, nullable=False, server_default='0')
+
+
+# one row per live collector worker in sharding mode, a worker whose
+# heartbeat is older than the lease ttl is considered dead
+class CollectorLeaseModel(Base):
+    __tablename__ = 'collector_leases'
+
+    worker_id = Column(String(100), primary_key=True)
+    started_at = Column(DateTime, nullable=False, server_default=func.now())
+    heartbeat_at = Column(DateTime, nullable=False, server_default=func.now())
+
+
+# API calls claimed per UTC day by all collector processes together
+class ApiUsageModel(Base):
+    __tablename__ = 'api_usage'
+
+    day = Column(Date, primary_key=True)
+    calls = Column(Integer, nullable=False, server_default='0')
+
+
 class WeatherModel(Base):
     __abstract__ = True
 
@@ -53,7 +84,8 @@ class WeatherModel(Base):
     wind_direction = Column(Integer)
     wind_gust = Column(Float)
     clouds = Column(Integer)
-    city = Column(ForeignKey('cities.id', ondelete='CASCADE'))
+    city = Column(ForeignKey('cities.id', ondelete='CASCADE'),
+                  primary_key=True)
     condition = Column(ForeignKey('conditions.id', ondelete='RESTRICT'))
     PrimaryKeyConstraint('timestamp', 'city')
     CheckConstraint(
@@ -96,7 +128,51 @@ class WeatherModel(Base):
 
 class WeatherFactModel(WeatherModel):
     __tablename__ = 'weather_fact'
+    __table_args__ = (
+        Index('ix_weather_fact_city_timestamp', 'city', text('timestamp DESC'),
+              postgresql_include=['temp', 'temp_min', 'temp_max',
+                                  'humidity']),
+        Index('ix_weather_fact_condition', 'condition'),
+        {'postgresql_partition_by': 'RANGE (timestamp)'},
+    )
 
 
 class WeatherForecastModel(WeatherModel):
     __tablename__ = 'weather_forecast'
+    __table_args__ = (
+        Index('ix_weather_forecast_city_timestamp', 'city', 'timestamp'),
+        Index('ix_weather_forecast_condition', 'condition'),
+    )
+
+
+class WeatherRollupModel(Base):
+    __abstract__ = True
+
+    city = Column(ForeignKey('cities.id', ondelete='CASCADE'),
+                  primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    temp_min = Column(Float)
+    temp_max = Column(Float)
+    temp_sum = Column(Float)
+    temp_count = Column(Integer, nullable=False)
+    temp_mean = Column(
+        Float, Computed('temp_sum / NULLIF(temp_count, 0)', persisted=True))
+    humidity_min = Column(Integer)
+    humidity_max = Column(Integer)
+    humidity_sum = Column(BigInteger)
+    humidity_count = Column(Integer, nullable=False)
+    humidity_mean = Column(
+        Float, Computed('humidity_sum::float / NULLIF(humidity_count, 0)',
+                        persisted=True))
+
+
+class WeatherRollupHourlyModel(WeatherRollupModel):
+    __tablename__ = 'weather_rollup_hourly'
+
+
+class WeatherRollupDailyModel(WeatherRollupModel):
+    __tablename__ = 'weather_rollup_daily'
+
+
+class WeatherRollupMonthlyModel(WeatherRollupModel):
+    __tablename__ = 'weather_rollup_monthly'
@@ -0,0 +1,64 @@
+import re
+from datetime import date
+from typing import Iterable
+
+from sqlalchemy import Connection, text
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table_name: str, month: date) -> str:
+    return f'{table_name}_{month:%Y_%m}'
+
+
+def ensure_partitions(connection: Connection, table_name: str,
+                      months: Iterable[date]) -> list[str]:
+    existing = {name for name, _ in list_partitions(connection, table_name)}
+    created = []
+    for month in sorted({month_start(m) for m in months}):
+        name = partition_name(table_name, month)
+        if name in existing:
+            continue
+        connection.exec_driver_sql(
+            f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table_name}" '
+            f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')")
+        created.append(name)
+    return created
+
+
+def list_partitions(connection: Connection,
+                    table_name: str) -> list[tuple[str, date]]:
+    rows = connection.execute(text(
+        'SELECT child.relname FROM pg_inherits '
+        'JOIN pg_class parent ON pg_inherits.inhparent = parent.oid '
+        'JOIN pg_class child ON pg_inherits.inhrelid = child.oid '
+        'WHERE parent.relname = :table_name'), {'table_name': table_name})
+    partitions = []
+    pattern = re.compile(rf'^{re.escape(table_name)}_(\d{{4}})_(\d{{2}})$')
+    for (name,) in rows:
+        match = pattern.match(name)
+        if match:
+            partitions.append(
+                (name, date(int(match[1]), int(match[2]), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def drop_expired_partitions(connection: Connection, table_name: str,
+                            retention_months: int, today: date) -> list[str]:
+    cutoff = add_months(month_start(today), -retention_months)
+    dropped = []
+    for name, month in list_partitions(connection, table_name):
+        if month >= cutoff:
+            break
+        connection.exec_driver_sql(
+            f'ALTER TABLE "{table_name}" DETACH PARTITION "{name}"')
+        connection.exec_driver_sql(f'DROP TABLE "{name}"')
+        dropped.append(name)
+    return dropped
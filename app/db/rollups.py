@@ -0,0 +1,107 @@
+from datetime import datetime, timezone
+from typing import Iterable
+
+from sqlalchemy import Connection, text
+
+# (rollup table, source table, source time column, bucket unit), each
+# level is aggregated from the one above it, only the first reads raw rows
+LEVELS = (
+    ('weather_rollup_hourly', 'weather_fact', 'timestamp', 'hour'),
+    ('weather_rollup_daily', 'weather_rollup_hourly', 'bucket', 'day'),
+    ('weather_rollup_monthly', 'weather_rollup_daily', 'bucket', 'month'),
+)
+
+RAW_AGGREGATES = '''
+    min(s.temp), max(s.temp), sum(s.temp), count(s.temp),
+    min(s.humidity), max(s.humidity), sum(s.humidity), count(s.humidity)
+'''
+
+ROLLUP_AGGREGATES = '''
+    min(s.temp_min), max(s.temp_max), sum(s.temp_sum),
+    coalesce(sum(s.temp_count), 0),
+    min(s.humidity_min), max(s.humidity_max), sum(s.humidity_sum),
+    coalesce(sum(s.humidity_count), 0)
+'''
+
+VALUE_COLUMNS = ('temp_min', 'temp_max', 'temp_sum', 'temp_count',
+                 'humidity_min', 'humidity_max', 'humidity_sum',
+                 'humidity_count')
+
+TOUCHED_TABLE = '_rollup_touched'
+
+
+def _upsert_level(connection: Connection, level: tuple,
+                  scope: str, params: dict) -> int:
+    table, source, time_column, unit = level
+    aggregates = (RAW_AGGREGATES if source == 'weather_fact'
+                  else ROLLUP_AGGREGATES)
+    assignments = ', '.join(f'{c} = EXCLUDED.{c}' for c in VALUE_COLUMNS)
+    result = connection.execute(text(f'''
+        INSERT INTO {table} (bucket, city, {', '.join(VALUE_COLUMNS)})
+        SELECT date_trunc('{unit}', s.{time_column}) AS bucket, s.city,
+            {aggregates}
+        FROM {source} s
+        {scope.format(time_column=time_column, unit=unit)}
+        GROUP BY 1, 2
+        ON CONFLICT (city, bucket) DO UPDATE SET {assignments}
+    '''), params)
+    return result.rowcount
+
+
+def _to_utc_naive(timestamp: datetime) -> datetime:
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def touched_hours(rows: Iterable[dict]) -> set[tuple[int, datetime]]:
+    if hasattr(rows, 'touched_hours'):
+        return rows.touched_hours()
+    return {(row['city'], _to_utc_naive(row['timestamp'])
+             .replace(minute=0, second=0, microsecond=0))
+            for row in rows}
+
+
+def update_rollups(connection: Connection, rows: Iterable[dict]) -> int:
+    touched = touched_hours(rows)
+    if not touched:
+        return 0
+
+    connection.exec_driver_sql(
+        f'CREATE TEMP TABLE IF NOT EXISTS {TOUCHED_TABLE} '
+        '(city integer, bucket timestamp) ON COMMIT DROP')
+    connection.exec_driver_sql(f'TRUNCATE {TOUCHED_TABLE}')
+    cities, buckets = zip(*touched)
+    connection.execute(text(
+        f'INSERT INTO {TOUCHED_TABLE} '
+        'SELECT * FROM unnest(CAST(:cities AS integer[]), '
+        'CAST(:buckets AS timestamp[]))'),
+        {'cities': list(cities), 'buckets': list(buckets)})
+
+    # only the buckets that got new rows are recomputed, from the level
+    # right below them
+    scope = f'''
+        JOIN (SELECT DISTINCT city, date_trunc('{{unit}}', bucket) AS bucket
+              FROM {TOUCHED_TABLE}) t
+        ON s.city = t.city
+        AND s.{{time_column}} >= t.bucket
+        AND s.{{time_column}} < t.bucket + interval '1 {{unit}}'
+    '''
+    updated = 0
+    for level in LEVELS:
+        updated += _upsert_level(connection, level, scope, {})
+    return updated
+
+
+def rebuild_rollups(connection: Connection, start: datetime,
+                    end: datetime) -> int:
+    # start and end must be month boundaries so every level sees
+    # complete buckets
+    scope = '''
+        WHERE s.{time_column} >= :start AND s.{time_column} < :end
+    '''
+    updated = 0
+    for level in LEVELS:
+        updated += _upsert_level(connection, level, scope,
+                                 {'start': start, 'end': end})
+    return updated
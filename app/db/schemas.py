@@ -1,9 +1,10 @@
 import sys
 from datetime import datetime
-from typing import Optional
+from typing import Annotated, NamedTuple, Optional
 
-from pydantic import (BaseModel, Field, ValidationInfo, field_validator,
-                      model_validator)
+from pydantic import (AfterValidator, BaseModel, Field, TypeAdapter,
+                      ValidationError, field_validator, model_validator)
+from typing_extensions import TypedDict
 
 sys.path.append('/app')
 
@@ -49,71 +50,84 @@ class ConditionSchema(BaseModel):
     description: str
 
 
+# range checks are compiled into the core validator once at import instead
+# of reading CONSTR in a python validator for every value
+Temperature = Annotated[float, Field(gt=CONSTR['MIN_TEMP_KELVIN'],
+                                     lt=CONSTR['MAX_TEMP_KELVIN'])]
+Pressure = Annotated[int, Field(gt=CONSTR['MIN_PRESSURE_HPA'],
+                                lt=CONSTR['MAX_PRESSURE_HPA'])]
+Humidity = Annotated[int, Field(ge=CONSTR['MIN_HUMIDITY_PERC'],
+                                le=CONSTR['MAX_HUMIDITY_PERC'])]
+WindSpeed = Annotated[float, Field(ge=CONSTR['MIN_WIND_SPEED_M_SEC'],
+                                   lt=CONSTR['MAX_WIND_SPEED_M_SEC'])]
+WindDirection = Annotated[int, Field(ge=CONSTR['MIN_WIND_DIR_DEG'],
+                                     le=CONSTR['MAX_WIND_DIR_DEG'])]
+Cloudiness = Annotated[int, Field(ge=CONSTR['MIN_CLOUDNESS_PERC'],
+                                  le=CONSTR['MAX_CLOUDNESS_PERC'])]
+
+
+def check_temp_presence(row: dict) -> dict:
+    if not (row['temp'] or row['temp_min'] or row['temp_max']):
+        raise ValueError('data must contain temperature information')
+    return row
+
+
 class WeatherSchema(BaseModel):
     timestamp: datetime
-    temp: Optional[float]
-    temp_min: Optional[float]
-    temp_max: Optional[float]
-    pressure: Optional[int]
-    humidity: Optional[int]
-    wind_speed: Optional[float]
-    wind_direction: Optional[int]
-    wind_gust: Optional[float]
-    clouds: Optional[int]
+    temp: Optional[Temperature]
+    temp_min: Optional[Temperature]
+    temp_max: Optional[Temperature]
+    pressure: Optional[Pressure]
+    humidity: Optional[Humidity]
+    wind_speed: Optional[WindSpeed]
+    wind_direction: Optional[WindDirection]
+    wind_gust: Optional[WindSpeed]
+    clouds: Optional[Cloudiness]
     city: int
     condition: Optional[int]
 
     @model_validator(mode='after')
     def check_if_temp_info_presence(self) -> 'WeatherSchema':
-        if not (self.temp or self.temp_min or self.temp_max):
-            raise ValueError('data must contain temperature information')
+        check_temp_presence(self.__dict__)
         return self
 
-    @field_validator('temp', 'temp_min', 'temp_max')
-    @classmethod
-    def temp_valid_range(cls, v: float, info: ValidationInfo) -> float:
-        if v and not CONSTR['MIN_TEMP_KELVIN'] < v < CONSTR['MAX_TEMP_KELVIN']:
-            raise ValueError(
-                f'invalid temperature value for field {info.field_name}')
-        return v
 
-    @field_validator('wind_speed', 'wind_gust')
-    @classmethod
-    def wind_valid_range(cls, v: float, info: ValidationInfo) -> float:
-        if (v and not CONSTR['MIN_WIND_SPEED_M_SEC']
-                <= v < CONSTR['MAX_WIND_SPEED_M_SEC']):
-            raise ValueError(
-                f'invalid value for field {info.field_name}')
-        return v
+class WeatherRow(TypedDict):
+    timestamp: datetime
+    temp: Optional[Temperature]
+    temp_min: Optional[Temperature]
+    temp_max: Optional[Temperature]
+    pressure: Optional[Pressure]
+    humidity: Optional[Humidity]
+    wind_speed: Optional[WindSpeed]
+    wind_direction: Optional[WindDirection]
+    wind_gust: Optional[WindSpeed]
+    clouds: Optional[Cloudiness]
+    city: int
+    condition: Optional[int]
 
-    @field_validator('pressure')
-    @classmethod
-    def pressure_valid_range(cls, v: int) -> int:
-        if (v and not
-                CONSTR['MIN_PRESSURE_HPA'] < v < CONSTR['MAX_PRESSURE_HPA']):
-            raise ValueError('invalid pressure value')
-        return v
 
-    @field_validator('humidity')
-    @classmethod
-    def humidity_valid_range(cls, v: int) -> int:
-        if (v and not CONSTR['MIN_HUMIDITY_PERC']
-                <= v <= CONSTR['MAX_HUMIDITY_PERC']):
-            raise ValueError('invalid humidity value')
-        return v
+class RowError(NamedTuple):
+    index: int
+    field: Optional[str]
+    message: str
 
-    @field_validator('wind_direction')
-    @classmethod
-    def wind_direction_valid_range(cls, v: int) -> int:
-        if (v and not
-                CONSTR['MIN_WIND_DIR_DEG'] <= v <= CONSTR['MAX_WIND_DIR_DEG']):
-            raise ValueError('invalid wind direction value')
-        return v
 
-    @field_validator('clouds')
-    @classmethod
-    def clouds_valid_range(cls, v: int) -> int:
-        if (v and not CONSTR['MIN_CLOUDNESS_PERC']
-                <= v <= CONSTR['MAX_CLOUDNESS_PERC']):
-            raise ValueError('invalid clouds value')
-        return v
+# rows come out as plain dicts, there is no model to build and dump
+WEATHER_ROWS = TypeAdapter(
+    list[Annotated[WeatherRow, AfterValidator(check_temp_presence)]])
+
+
+def validate_weather_rows(rows: list[dict]
+                          ) -> tuple[list[dict], list[RowError]]:
+    try:
+        return WEATHER_ROWS.validate_python(rows), []
+    except ValidationError as err:
+        errors = [RowError(e['loc'][0],
+                           e['loc'][1] if len(e['loc']) > 1 else None,
+                           e['msg'])
+                  for e in err.errors(include_url=False)]
+    invalid = {e.index for e in errors}
+    valid = WEATHER_ROWS.validate_python(
+        [row for i, row in enumerate(rows) if i not in invalid])
+    return valid, errors
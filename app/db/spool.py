@@ -0,0 +1,168 @@
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+from sqlalchemy.exc import InterfaceError, OperationalError, SQLAlchemyError
+
+sys.path.append('/app')
+
+from settings import (SPOOL_FSYNC_INTERVAL_SEC, SPOOL_FSYNC_RECORDS,
+                      SPOOL_MAX_BYTES, SPOOL_PATH, logger)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'cannot spool {type(value).__name__}')
+
+
+def dumps(record: dict) -> bytes:
+    if orjson:
+        return orjson.dumps(record)
+    return json.dumps(record, default=_default).encode()
+
+
+loads = orjson.loads if orjson else json.loads
+
+
+# append-only JSON lines, one line per failed write. Every append is handed
+# to the OS, fsync only runs every fsync_records records or after
+# fsync_interval_sec, so a power loss can cost at most that tail
+class Spool:
+    def __init__(self, path: str = SPOOL_PATH,
+                 max_bytes: int = SPOOL_MAX_BYTES,
+                 fsync_records: int = SPOOL_FSYNC_RECORDS,
+                 fsync_interval_sec: float = SPOOL_FSYNC_INTERVAL_SEC
+                 ) -> None:
+        self.path = path
+        self.draining_path = path + '.draining'
+        self.rejected_path = path + '.rejected'
+        self.max_bytes = max_bytes
+        self.fsync_records = fsync_records
+        self.fsync_interval_sec = fsync_interval_sec
+        self._file = None
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+
+    def _sync(self) -> None:
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def append(self, record: dict) -> bool:
+        line = dumps(record) + b'\n'
+        with self._lock:
+            if self._file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = open(self.path, 'ab')
+            if self._file.tell() + len(line) > self.max_bytes:
+                logger.error('spool %s is full (%d bytes), record dropped',
+                             self.path, self._file.tell())
+                return False
+            self._file.write(line)
+            self._file.flush()
+            self._unsynced += 1
+            if (self._unsynced >= self.fsync_records
+                    or time.monotonic() - self._synced_at
+                    >= self.fsync_interval_sec):
+                self._sync()
+        return True
+
+    def sync(self) -> None:
+        with self._lock:
+            if self._file is not None and self._unsynced:
+                self._sync()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+
+    def _take_pending(self) -> bool:
+        # new failures go to a fresh file while the old one is replayed,
+        # a draining file left over from a crash is replayed first
+        if os.path.exists(self.draining_path):
+            return True
+        with self._lock:
+            if (not os.path.exists(self.path)
+                    or not os.path.getsize(self.path)):
+                return False
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+            os.replace(self.path, self.draining_path)
+        return True
+
+    def _keep(self, lines: list[bytes], file) -> None:
+        temporary = self.draining_path + '.tmp'
+        with open(temporary, 'wb') as rest:
+            rest.writelines(lines)
+            for line in file:
+                rest.write(line)
+            rest.flush()
+            os.fsync(rest.fileno())
+        os.replace(temporary, self.draining_path)
+
+    def _reject(self, line: bytes) -> None:
+        with open(self.rejected_path, 'ab') as rejected:
+            rejected.write(line)
+
+    def drain(self, replay: Callable[[dict], None]) -> tuple[int, int]:
+        replayed = rejected = 0
+        with self._drain_lock:
+            if not self._take_pending():
+                return replayed, rejected
+            with open(self.draining_path, 'rb') as file:
+                for line in file:
+                    try:
+                        record = loads(line)
+                    except ValueError:
+                        # a torn last line after a crash
+                        logger.warning('skipped unreadable spool line')
+                        continue
+                    try:
+                        replay(record)
+                    except (OperationalError, InterfaceError) as err:
+                        logger.warning('database still unavailable, '
+                                       '%d spooled writes replayed: %s',
+                                       replayed, err)
+                        self._keep([line], file)
+                        return replayed, rejected
+                    except SQLAlchemyError as err:
+                        logger.error('spooled write rejected, moved to '
+                                     '%s: %s', self.rejected_path, err)
+                        self._reject(line)
+                        rejected += 1
+                    else:
+                        replayed += 1
+            os.remove(self.draining_path)
+        return replayed, rejected
+
+
+_spool: Optional[Spool] = None
+_spool_lock = threading.Lock()
+
+
+def get_spool() -> Spool:
+    global _spool
+    if _spool is None:
+        with _spool_lock:
+            if _spool is None:
+                _spool = Spool()
+    return _spool
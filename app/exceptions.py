@@ -11,3 +11,7 @@ class APIConnectionException(RequestException):
 
 class BadResponseStatusException(RequestException):
     pass
+
+
+class ResponseUnchangedException(Exception):
+    pass
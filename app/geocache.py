@@ -0,0 +1,73 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Optional
+
+from settings import GEOCACHE_PATH, GEOCACHE_TTL_SEC, logger
+
+
+def make_key(query: str, country: Optional[str] = None) -> str:
+    # "  São  Paulo , br" and "são paulo,BR" end up under the same key, a
+    # trailing two-letter part of the query is taken as the country hint
+    text = unicodedata.normalize('NFKC', query).casefold()
+    parts = [re.sub(r'\s+', ' ', part).strip() for part in text.split(',')]
+    parts = [part for part in parts if part]
+    if country is None and len(parts) > 1 and len(parts[-1]) == 2:
+        country = parts.pop()
+    return f'{", ".join(parts)}|{(country or "").casefold()}'
+
+
+class GeoCache:
+    def __init__(self, path: str = GEOCACHE_PATH,
+                 ttl_sec: float = GEOCACHE_TTL_SEC) -> None:
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS geocode (key TEXT PRIMARY KEY, '
+                'response TEXT NOT NULL, fetched_at REAL NOT NULL)')
+
+    def get(self, query: str) -> Optional[list]:
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT response, fetched_at FROM geocode WHERE key = ?',
+                (make_key(query),)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl_sec:
+            return None
+        return json.loads(row[0])
+
+    def put(self, query: str, response: list) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO geocode VALUES (?, ?, ?)',
+                (make_key(query), json.dumps(response), time.time()))
+
+    def invalidate(self, query: Optional[str] = None) -> int:
+        with self._lock, self._connection:
+            if query is None:
+                cursor = self._connection.execute('DELETE FROM geocode')
+            else:
+                cursor = self._connection.execute(
+                    'DELETE FROM geocode WHERE key = ?', (make_key(query),))
+        return cursor.rowcount
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+_geocache: Optional[GeoCache] = None
+_geocache_lock = threading.Lock()
+
+
+def get_geocache() -> GeoCache:
+    global _geocache
+    if _geocache is None:
+        with _geocache_lock:
+            if _geocache is None:
+                _geocache = GeoCache()
+                logger.debug('geocoding cache opened at %s', GEOCACHE_PATH)
+    return _geocache
@@ -2,27 +2,56 @@ import time
 from sys import argv
 from typing import Optional
 
-from db.models import (CityModel, ConditionModel, WeatherFactModel,
-                       WeatherForecastModel)
+from db.models import ConditionModel, WeatherFactModel, WeatherForecastModel
 from db.schemas import ConditionSchema
-from db.session import get_session
-from settings import logger
-from sqlalchemy import delete
-from utils import (bulk_insert_to_db, get_cities_list, log, read_file,
-                   validate_response)
-from workers import CityFetcher, ForecastFetcher, WeatherFetcher
+from geocache import get_geocache
+from metrics import (CYCLE_DURATION, CYCLE_FINISHED, start_http_server,
+                     timed, write_textfile)
+from pipeline import Pipeline, Rows
+from ratelimit import rate_limiter
+from refdata import refdata
+from respcache import forecast_cache
+from retry import Deadline
+from scheduler import Scheduler, StaggeredFetch
+from sharding import shard
+from settings import (COLUMNAR_BATCHES, CYCLE_DEADLINE_SEC,
+                      DAEMON_RUN_ON_START, FORECAST_INTERVAL_SEC,
+                      GEOCODE_CHUNK_SIZE, METRICS_PORT,
+                      METRICS_TEXTFILE_PATH, REFDATA_REFRESH_SEC,
+                      SHARD_HEARTBEAT_SEC, SHARDING_ENABLED,
+                      SPOOL_DRAIN_SEC, STAGGER_TICK_SEC,
+                      STAGGERED_SCHEDULING, WEATHER_INTERVAL_SEC, logger)
+from utils import (backfill_rollups, bulk_insert_to_db, column_values,
+                   drain_spool, get_geocoded_names, log, maintain_partitions,
+                   read_file, refresh_in_db, set_cities_owm_ids,
+                   upsert_cities, validate_response)
+from workers import (BatchWeatherFetcher, CityFetcher, ForecastFetcher,
+                     WeatherFetcher, get_cpu_pool, run_concurrently)
 
 
 @log('info')
 def load_cities() -> None:
-    data: dict = read_file('cities.json')
-    cities_data = []
-    for city in data:
-        city_data = CityFetcher(city_name=city).run
-        if city_data:
+    names = list(dict.fromkeys(read_file('cities.json')))
+    resolved = get_geocoded_names()
+    pending = [city for city in names if city not in resolved]
+    logger.info('%d of %d cities already geocoded, %d to go',
+                len(names) - len(pending), len(names), len(pending))
+
+    # every chunk is committed on its own, a failed run resumes from the
+    # first chunk that didn't make it
+    found = 0
+    for i in range(0, len(pending), GEOCODE_CHUNK_SIZE):
+        chunk = pending[i:i + GEOCODE_CHUNK_SIZE]
+        results = run_concurrently(
+            [CityFetcher(city_name=city) for city in chunk])
+        cities_data = []
+        for city, city_data in zip(chunk, results):
+            for row in city_data:
+                row['query_name'] = city
             cities_data.extend(city_data)
-    logger.info('got data for %d of %d cities', len(cities_data), len(data))
-    bulk_insert_to_db(CityModel, cities_data)
+        found += upsert_cities(cities_data)
+        logger.info('geocoded %d of %d cities', i + len(chunk), len(pending))
+    logger.info('got data for %d of %d cities', found, len(pending))
 
 
 @log('info')
@@ -34,33 +63,139 @@ def load_conditions() -> None:
 
 
 @log('info')
-def fetch_weather(cities) -> None:
-    cur_time = time.time()
+def invalidate_geocache() -> None:
+    removed = get_geocache().invalidate()
+    logger.info('removed %d entries from geocoding cache', removed)
+
+
+def write_results(kind: str, data: Rows) -> None:
+    refdata.check_conditions(data)
+    if kind == 'weather':
+        bulk_insert_to_db(WeatherFactModel, data)
+        return
+    result = refresh_in_db(WeatherForecastModel, data)
+    # forecasts skipped or only spooled are fetched and written again
+    if not (result.skipped or result.spooled):
+        forecast_cache.commit(set(column_values(data, 'city')))
 
-    weather_data, forecast_data = [], []
-    for c in cities:
-        if not c.latitude or not c.longitude:
-            continue
-        weather_data.extend(
-            WeatherFetcher(cur_time, c.id, c.latitude, c.longitude).run)
-        forecast_data.extend(
-            ForecastFetcher(cur_time, c.id, c.latitude, c.longitude).run)
 
-    logger.info('got weather data for %d of %d cities',
-                len(weather_data), len(cities))
+@log('info')
+def fetch_weather(cities, weather: bool = True,
+                  forecast: bool = True) -> None:
+    kind = '+'.join(name for name, enabled in (('weather', weather),
+                                               ('forecast', forecast))
+                    if enabled)
+    with timed(CYCLE_DURATION, kind):
+        collect(cities, weather, forecast)
+    CYCLE_FINISHED.set(time.time(), kind)
 
-    if weather_data:
-        bulk_insert_to_db(WeatherFactModel, weather_data)
 
-    if forecast_data:
-        with get_session() as session:
-            session.execute(delete(WeatherForecastModel))
-        bulk_insert_to_db(WeatherForecastModel, forecast_data)
+def collect(cities, weather: bool = True, forecast: bool = True) -> None:
+    cur_time = time.time()
+    deadline = Deadline(CYCLE_DEADLINE_SEC)
+
+    located = [c for c in cities if c.latitude and c.longitude]
+    weather_fetchers, single_fetchers, forecast_fetchers = [], [], []
+    if weather:
+        weather_fetchers = BatchWeatherFetcher.for_cities(
+            cur_time, [c for c in located if c.owm_id], deadline=deadline)
+        single_fetchers = [
+            WeatherFetcher(cur_time, c.id, c.latitude, c.longitude,
+                           deadline=deadline)
+            for c in located if not c.owm_id]
+        maintain_partitions(cur_time)
+    if forecast:
+        forecast_fetchers = [
+            ForecastFetcher(cur_time, c.id, c.latitude, c.longitude,
+                            deadline=deadline)
+            for c in located]
+
+    weather_fetchers.extend(single_fetchers)
+    cpu_pool = get_cpu_pool() if COLUMNAR_BATCHES else None
+    for fetcher in weather_fetchers + forecast_fetchers:
+        fetcher.columnar = COLUMNAR_BATCHES
+        fetcher.cpu_pool = cpu_pool
+
+    # rows are written in micro batches while the fetch is still running
+    pipeline = Pipeline(write_results)
+    rows = pipeline.run(
+        [('weather', f) for f in weather_fetchers]
+        + [('forecast', f) for f in forecast_fetchers])
+
+    set_cities_owm_ids(
+        {f.city_id: f.owm_id for f in single_fetchers if f.owm_id})
+
+    if weather:
+        logger.info('got weather data for %d of %d cities',
+                    rows['weather'] + pipeline.failed['weather'],
+                    len(cities))
+    if forecast:
+        hits, lookups = forecast_cache.pop_stats()
+        logger.info('got %d forecast points, %d of %d forecasts unchanged '
+                    '(hit rate %.0f%%)',
+                    rows['forecast'] + pipeline.failed['forecast'], hits,
+                    lookups, 100 * hits / lookups if lookups else 0)
+    if pipeline.failed:
+        logger.error('failed writing rows: %s', dict(pipeline.failed))
 
 
 def main() -> None:
-    cities: list[CityModel] = get_cities_list()
-    fetch_weather(cities)
+    try:
+        refdata.refresh()
+        drain_spool()
+        fetch_weather(refdata.cities)
+    finally:
+        rate_limiter.release()
+        if METRICS_TEXTFILE_PATH:
+            write_textfile(METRICS_TEXTFILE_PATH)
+
+
+def own_cities() -> list:
+    # in sharding mode every worker only fetches its part of the ring
+    if SHARDING_ENABLED:
+        return shard.filter(refdata.cities)
+    return refdata.cities
+
+
+def daemon() -> None:
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+    refdata.refresh()
+
+    scheduler = Scheduler()
+    scheduler.add_job('refresh reference data', refdata.refresh,
+                      REFDATA_REFRESH_SEC)
+    scheduler.add_job('drain spool', drain_spool, SPOOL_DRAIN_SEC,
+                      run_on_start=True)
+    if SHARDING_ENABLED:
+        shard.heartbeat()
+        scheduler.add_job('shard heartbeat', shard.heartbeat,
+                          SHARD_HEARTBEAT_SEC)
+    if STAGGERED_SCHEDULING:
+        scheduler.add_job('staggered fetch',
+                          StaggeredFetch(own_cities, fetch_weather),
+                          STAGGER_TICK_SEC)
+    elif WEATHER_INTERVAL_SEC == FORECAST_INTERVAL_SEC:
+        scheduler.add_job('fetch weather',
+                          lambda: fetch_weather(own_cities()),
+                          WEATHER_INTERVAL_SEC,
+                          run_on_start=DAEMON_RUN_ON_START)
+    else:
+        scheduler.add_job(
+            'fetch weather',
+            lambda: fetch_weather(own_cities(), forecast=False),
+            WEATHER_INTERVAL_SEC, run_on_start=DAEMON_RUN_ON_START)
+        scheduler.add_job(
+            'fetch forecast',
+            lambda: fetch_weather(own_cities(), weather=False),
+            FORECAST_INTERVAL_SEC, run_on_start=DAEMON_RUN_ON_START)
+    try:
+        scheduler.run()
+    finally:
+        rate_limiter.release()
+        # the others take over right away instead of after the lease ttl
+        if SHARDING_ENABLED:
+            shard.release()
 
 
 def launcher() -> None:
@@ -69,7 +204,11 @@ def launcher() -> None:
         logger.critical('''Invalid starting option. Use one of the following:
                         python main.py --load cities
                                        --load conditions
-                                       --start program''')
+                                       --invalidate geocache
+                                       --backfill rollups
+                                       --drain spool
+                                       --start program
+                                       --daemon''')
         return
 
     logger.info(f'launching {param}')
@@ -80,6 +219,10 @@ if __name__ == '__main__':
     START_OPTIONS = {
         '--load cities': load_cities,
         '--load conditions': load_conditions,
+        '--invalidate geocache': invalidate_geocache,
+        '--backfill rollups': backfill_rollups,
+        '--drain spool': drain_spool,
         '--start program': main,
+        '--daemon': daemon,
     }
     launcher()
@@ -0,0 +1,198 @@
+import bisect
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, Sequence
+
+from settings import logger
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CYCLE_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+REGISTRY: list['Metric'] = []
+
+
+def _escape(value) -> str:
+    return (str(value).replace('\\', r'\\').replace('"', r'\"')
+            .replace('\n', r'\n'))
+
+
+def _format(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str,
+                 labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: dict[tuple, object] = {}
+        # one uncontended lock per update is all the hot path pays
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _label_text(self, values: tuple, extra: str = '') -> str:
+        pairs = [f'{name}="{_escape(value)}"'
+                 for name, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{self._label_text(key)} {_format(value)}'
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}',
+                 f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, *labels) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    # per label set: one count per bucket (not cumulative), sum, count
+    def observe(self, value: float, *labels) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * len(self.buckets),
+                                                0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = {key: (list(counts), total, count)
+                      for key, (counts, total, count) in self._values.items()}
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                labels = self._label_text(key, f'le="{_format(bound)}"')
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            yield f'{self.name}_sum{self._label_text(key)} {_format(total)}'
+            yield f'{self.name}_count{self._label_text(key)} {count}'
+
+    def value(self, *labels):
+        state = self._values.get(labels)
+        return (state[1], state[2]) if state else (0.0, 0)
+
+
+API_LATENCY = Histogram(
+    'weather_api_request_seconds', 'OpenWeatherMap request latency',
+    ['endpoint'])
+API_RESPONSES = Counter(
+    'weather_api_responses_total',
+    'OpenWeatherMap responses by status code, "error" if none came back',
+    ['endpoint', 'status'])
+API_RETRIES = Counter(
+    'weather_api_retries_total', 'OpenWeatherMap requests retried',
+    ['endpoint'])
+VALIDATION_FAILURES = Counter(
+    'weather_validation_failures_total',
+    'Rows dropped by validation, by failing field', ['field'])
+ROWS_WRITTEN = Counter(
+    'weather_db_rows_total', 'Rows handed to the database by outcome',
+    ['table', 'result'])
+DB_WRITE_LATENCY = Histogram(
+    'weather_db_write_seconds', 'Duration of one database write',
+    ['table', 'operation'])
+CYCLE_DURATION = Histogram(
+    'weather_cycle_seconds', 'Duration of a collection cycle', ['kind'],
+    buckets=CYCLE_BUCKETS)
+CYCLE_FINISHED = Gauge(
+    'weather_cycle_finished_timestamp_seconds',
+    'Unix time the last successful collection cycle finished', ['kind'])
+
+
+def render() -> str:
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+def write_textfile(path: str) -> None:
+    # written aside and renamed, a collector never reads half a file
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as file:
+        file.write(render())
+    os.replace(temporary, path)
+    logger.debug('metrics written to %s', path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug('metrics request: ' + format, *args)
+
+
+def start_http_server(port: int,
+                      address: str = '') -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics',
+                     daemon=True).start()
+    logger.info('serving metrics on port %d', server.server_port)
+    return server
+
+
+class timed:
+    # with timed(HISTOGRAM, *labels): ...
+    def __init__(self, histogram: Histogram, *labels) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> 'timed':
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.perf_counter() - self.started,
+                               *self.labels)
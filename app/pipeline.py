@@ -0,0 +1,103 @@
+import queue
+import threading
+from collections import Counter
+from typing import Callable, Iterable, Union
+
+from db.batch import WeatherBatch
+from metrics import VALIDATION_FAILURES
+from settings import (COLUMNAR_BATCHES, FETCH_CONCURRENCY,
+                      PIPELINE_BATCH_ROWS, PIPELINE_QUEUE_DEPTH,
+                      PIPELINE_WRITERS, logger)
+from workers import Fetcher, run_streaming
+
+Rows = Union[list[dict], WeatherBatch]
+
+DONE = object()
+
+
+def combine_rows(results: list) -> Rows:
+    if not COLUMNAR_BATCHES:
+        return [row for result in results for row in result]
+    batch, errors = WeatherBatch.concat(results).validated()
+    for field, count in errors.items():
+        VALIDATION_FAILURES.inc(field, amount=count)
+        logger.error('response validation error: %d rows with invalid %s',
+                     count, field)
+    return batch
+
+
+class Pipeline:
+    # fetch -> bounded queue -> writers. Fetcher threads block on a full
+    # queue, so no more than queue_depth results plus one unwritten micro
+    # batch per writer are ever held in memory
+    def __init__(self, write: Callable[[str, Rows], None],
+                 batch_rows: int = PIPELINE_BATCH_ROWS,
+                 queue_depth: int = PIPELINE_QUEUE_DEPTH,
+                 writers: int = PIPELINE_WRITERS,
+                 concurrency: int = FETCH_CONCURRENCY) -> None:
+        self.write = write
+        self.batch_rows = batch_rows
+        self.writers = max(1, writers)
+        self.concurrency = concurrency
+        self.queue: queue.Queue = queue.Queue(maxsize=max(1, queue_depth))
+        self.rows: Counter = Counter()
+        self.failed: Counter = Counter()
+        self._kinds: dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def _put(self, fetcher: Fetcher, result: list) -> None:
+        if len(result):
+            self.queue.put((self._kinds[id(fetcher)], result))
+
+    def _flush(self, kind: str, results: list) -> None:
+        # a writer must survive any batch, once all of them are gone the
+        # fetchers block on the full queue for good
+        count = sum(len(result) for result in results)
+        try:
+            data = combine_rows(results)
+            count = len(data)
+            if count:
+                self.write(kind, data)
+        except Exception:
+            # the batches already written stay written
+            logger.exception('failed writing %d %s rows', count, kind)
+            with self._lock:
+                self.failed[kind] += count
+            return
+        finally:
+            results.clear()
+        with self._lock:
+            self.rows[kind] += count
+
+    def _writer(self) -> None:
+        pending: dict[str, list] = {}
+        sizes: Counter = Counter()
+        while (item := self.queue.get()) is not DONE:
+            kind, result = item
+            pending.setdefault(kind, []).append(result)
+            sizes[kind] += len(result)
+            if sizes[kind] >= self.batch_rows:
+                self._flush(kind, pending[kind])
+                sizes[kind] = 0
+        for kind, results in pending.items():
+            self._flush(kind, results)
+
+    def run(self, jobs: Iterable[tuple[str, Fetcher]]) -> Counter:
+        fetchers = []
+        for kind, fetcher in jobs:
+            self._kinds[id(fetcher)] = kind
+            fetchers.append(fetcher)
+
+        threads = [threading.Thread(target=self._writer,
+                                    name=f'writer-{i}', daemon=True)
+                   for i in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        try:
+            run_streaming(fetchers, self._put, self.concurrency)
+        finally:
+            for _ in threads:
+                self.queue.put(DONE)
+            for thread in threads:
+                thread.join()
+        return self.rows
@@ -0,0 +1,263 @@
+import asyncio
+import math
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from db.models import ApiUsageModel
+from db.session import engine
+from settings import (API_CALLS_PER_DAY, API_CALLS_PER_MINUTE,
+                      API_QUOTA_CLAIM_CALLS, logger)
+from sqlalchemy import Connection, select, update
+from sqlalchemy.dialects.postgresql import insert
+
+
+class TokenBucket:
+    def __init__(self, calls: int, period_sec: float) -> None:
+        self.calls = calls
+        self.period_sec = period_sec
+        self.capacity = calls
+        self.rate = calls / period_sec
+        self._tokens = float(calls)
+        self._updated = time.monotonic()
+
+    def scale(self, share: float) -> None:
+        self.capacity = max(1, int(self.calls * share))
+        self.rate = self.capacity / self.period_sec
+        self._tokens = min(self._tokens, self.capacity)
+
+    def reserve(self, now: float) -> float:
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate
+
+    def refund(self) -> None:
+        self._tokens += 1
+
+
+def utc_today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+def day_start(day: date) -> float:
+    return datetime(day.year, day.month, day.day,
+                    tzinfo=timezone.utc).timestamp()
+
+
+def claim_calls(connection: Connection, day: date, calls: int, limit: int,
+                unrecorded: int = 0) -> int:
+    # the row is locked, so concurrent processes never hand out more than
+    # limit calls for one day between them
+    connection.execute(insert(ApiUsageModel).values(day=day)
+                       .on_conflict_do_nothing(index_elements=['day']))
+    used = connection.scalar(select(ApiUsageModel.calls)
+                             .where(ApiUsageModel.day == day)
+                             .with_for_update())
+    granted = max(0, min(calls, limit - used - unrecorded))
+    connection.execute(update(ApiUsageModel)
+                       .where(ApiUsageModel.day == day)
+                       .values(calls=ApiUsageModel.calls
+                               + unrecorded + granted))
+    return granted
+
+
+def return_calls(connection: Connection, day: date, calls: int) -> None:
+    connection.execute(update(ApiUsageModel)
+                       .where(ApiUsageModel.day == day)
+                       .values(calls=ApiUsageModel.calls - calls))
+
+
+class QuotaStore:
+    def claim(self, day: date, calls: int, limit: int,
+              unrecorded: int = 0) -> int:
+        with engine.begin() as connection:
+            return claim_calls(connection, day, calls, limit, unrecorded)
+
+    def give_back(self, day: date, calls: int) -> None:
+        with engine.begin() as connection:
+            return_calls(connection, day, calls)
+
+
+class DailyQuota:
+    # the budget of a UTC day is kept by the store (the api_usage table),
+    # so restarts, one-off runs and several collectors all draw on the same
+    # one. Calls are claimed block at a time by a background thread, the
+    # next block is asked for while half of the current one is left
+    def __init__(self, limit: int, store: Optional[QuotaStore] = None,
+                 block: int = API_QUOTA_CLAIM_CALLS) -> None:
+        self.limit = limit
+        self.store = store or QuotaStore()
+        self.block = block
+        self._day = utc_today()
+        self._allowance = 0
+        self._unrecorded = 0
+        self._exhausted = False
+        self._claiming = False
+        self._changed = threading.Condition()
+
+    def _roll_day(self) -> None:
+        today = utc_today()
+        if today != self._day:
+            self._day, self._allowance = today, 0
+            self._unrecorded, self._exhausted = 0, False
+
+    def _start_claim(self) -> None:
+        if self._claiming or self._exhausted:
+            return
+        self._claiming = True
+        threading.Thread(target=self._claim,
+                         args=(self._day, self._unrecorded),
+                         name='quota claim', daemon=True).start()
+
+    def _claim(self, day: date, unrecorded: int) -> None:
+        recorded = True
+        try:
+            granted = self.store.claim(day, self.block, self.limit,
+                                       unrecorded)
+        except Exception as err:
+            # counted here and added to the store with the next claim
+            recorded = False
+            granted = (self.block if unrecorded + self.block <= self.limit
+                       else 0)
+            logger.warning('API usage not recorded, database unavailable: '
+                           '%s', err)
+        with self._changed:
+            self._claiming = False
+            if day == self._day:
+                if recorded:
+                    self._unrecorded -= unrecorded
+                else:
+                    self._unrecorded += granted
+                self._allowance += granted
+                if not granted:
+                    self._exhausted = True
+                    logger.warning('daily API quota of %s is used up', day)
+            self._changed.notify_all()
+
+    def take(self, timeout: float = math.inf) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                self._roll_day()
+                if self._allowance:
+                    self._allowance -= 1
+                    if self._allowance < self.block // 2:
+                        self._start_claim()
+                    return True
+                self._start_claim()
+                wait = deadline - time.monotonic()
+                if self._exhausted:
+                    # nothing left before the next UTC day
+                    next_day = day_start(self._day + timedelta(days=1))
+                    if next_day - time.time() > wait:
+                        return False
+                    wait = next_day - time.time()
+                if wait <= 0:
+                    return False
+                self._changed.wait(None if wait == math.inf else wait)
+
+    def refund(self) -> None:
+        with self._changed:
+            self._allowance += 1
+            self._changed.notify()
+
+    def release(self) -> None:
+        with self._changed:
+            day, calls, self._allowance = self._day, self._allowance, 0
+        if not calls:
+            return
+        try:
+            self.store.give_back(day, calls)
+        except Exception as err:
+            logger.warning('unused API calls not returned: %s', err)
+
+
+class RateLimiter:
+    def __init__(self, calls_per_minute: Optional[int] = None,
+                 calls_per_day: Optional[int] = None,
+                 quota_store: Optional[QuotaStore] = None) -> None:
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self._buckets = []
+        if calls_per_minute:
+            self._buckets.append(TokenBucket(calls_per_minute, 60))
+        self.quota = (DailyQuota(calls_per_day, quota_store)
+                      if calls_per_day else None)
+
+    # tokens are reserved under the lock, the caller then sleeps outside of
+    # it with time.sleep or asyncio.sleep, so threads and coroutines share
+    # one budget and queue up in order. A call that would have to wait
+    # longer than max_wait gets its tokens back and None instead of a delay
+    def reserve(self, max_wait: float = math.inf) -> Optional[float]:
+        with self._lock:
+            now = time.monotonic()
+            delay = max((b.reserve(now) for b in self._buckets), default=0.0)
+            delay = max(delay, self._paused_until - now)
+            if delay > max_wait:
+                for bucket in self._buckets:
+                    bucket.refund()
+                return None
+            return delay
+
+    # the daily quota is taken first and outside of the lock, waiting for
+    # a claim never holds up the other callers
+    def acquire(self, max_wait: float = math.inf) -> bool:
+        started = time.monotonic()
+        if self.quota is not None and not self.quota.take(max_wait):
+            return False
+        delay = self.reserve(max_wait - (time.monotonic() - started))
+        if delay is None:
+            if self.quota is not None:
+                self.quota.refund()
+            return False
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+    async def acquire_async(self) -> None:
+        if self.quota is not None:
+            await asyncio.to_thread(self.quota.take)
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    # collectors sharing one API key split the per-minute budget, the daily
+    # quota is shared through its store already
+    def set_workers(self, count: int) -> None:
+        with self._lock:
+            for bucket in self._buckets:
+                bucket.scale(1 / max(1, count))
+
+    # unused calls of the day go back to the store on exit
+    def release(self) -> None:
+        if self.quota is not None:
+            self.quota.release()
+
+    def back_off(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until,
+                                     time.monotonic() + seconds)
+
+
+def parse_retry_after(value: Optional[str],
+                      default: float = 0.0) -> float:
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+rate_limiter = RateLimiter(API_CALLS_PER_MINUTE, API_CALLS_PER_DAY)
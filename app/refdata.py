@@ -0,0 +1,124 @@
+import threading
+from array import array
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from db.batch import WeatherBatch
+from db.models import CityModel, ConditionModel, ReferenceVersionModel
+from db.session import engine
+from settings import logger
+from sqlalchemy import Connection, select
+from sqlalchemy.exc import SQLAlchemyError
+
+
+class City(NamedTuple):
+    id: int
+    latitude: Optional[float]
+    longitude: Optional[float]
+    owm_id: Optional[int]
+    fetch_interval_sec: Optional[int]
+
+
+class CityTable:
+    # one typed array per column instead of a list of ORM objects, missing
+    # coordinates are stored as NaN and missing ids/intervals as 0
+    def __init__(self, rows: Iterable[tuple] = ()) -> None:
+        self.ids = array('q')
+        self.latitude = array('d')
+        self.longitude = array('d')
+        self.owm_ids = array('q')
+        self.fetch_intervals = array('q')
+        for city_id, lat, lon, owm_id, interval in rows:
+            self.ids.append(city_id)
+            self.latitude.append(float('nan') if lat is None else lat)
+            self.longitude.append(float('nan') if lon is None else lon)
+            self.owm_ids.append(owm_id or 0)
+            self.fetch_intervals.append(interval or 0)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, index: int) -> City:
+        lat, lon = self.latitude[index], self.longitude[index]
+        return City(self.ids[index],
+                    None if lat != lat else lat,
+                    None if lon != lon else lon,
+                    self.owm_ids[index] or None,
+                    self.fetch_intervals[index] or None)
+
+    def __iter__(self) -> Iterator[City]:
+        return (self[i] for i in range(len(self.ids)))
+
+
+def load_versions(connection: Connection) -> dict[str, int]:
+    return dict(connection.execute(select(
+        ReferenceVersionModel.table_name, ReferenceVersionModel.version
+    )).all())
+
+
+def load_cities(connection: Connection) -> CityTable:
+    return CityTable(connection.execute(select(
+        CityModel.id, CityModel.latitude, CityModel.longitude,
+        CityModel.owm_id, CityModel.fetch_interval_sec
+    ).order_by(CityModel.id)))
+
+
+def load_conditions(connection: Connection) -> frozenset[int]:
+    return frozenset(connection.scalars(select(ConditionModel.id)))
+
+
+class ReferenceCache:
+    LOADERS = {
+        CityModel.__tablename__: ('cities', load_cities),
+        ConditionModel.__tablename__: ('conditions', load_conditions),
+    }
+
+    def __init__(self) -> None:
+        self.cities = CityTable()
+        self.conditions: frozenset[int] = frozenset()
+        self.versions: dict[str, Optional[int]] = {
+            table: None for table in self.LOADERS}
+        self._lock = threading.Lock()
+
+    # one small query per call, the tables themselves are only read again
+    # when their version moved. With the database gone the cached tables
+    # are kept, the fetch doesn't need it until the writes
+    def refresh(self) -> list[str]:
+        reloaded = []
+        try:
+            with self._lock, engine.connect() as connection:
+                versions = load_versions(connection)
+                for table, (attr, loader) in self.LOADERS.items():
+                    version = versions.get(table)
+                    if (version is not None
+                            and version == self.versions[table]):
+                        continue
+                    setattr(self, attr, loader(connection))
+                    self.versions[table] = version
+                    reloaded.append(table)
+        except SQLAlchemyError as err:
+            logger.error('failed refreshing reference data, keeping %d '
+                         'cached cities: %s', len(self.cities), err)
+        if reloaded:
+            logger.info('reloaded reference data: %s (%d cities, '
+                        '%d conditions)', ', '.join(reloaded),
+                        len(self.cities), len(self.conditions))
+        return reloaded
+
+    def check_conditions(self, rows: list[dict]) -> list[dict]:
+        unknown = set()
+        if isinstance(rows, WeatherBatch):
+            unknown.update(rows.null_unknown('condition', self.conditions))
+        else:
+            for row in rows:
+                condition = row.get('condition')
+                if (condition is not None
+                        and condition not in self.conditions):
+                    unknown.add(condition)
+                    row['condition'] = None
+        if unknown:
+            logger.warning('unknown condition ids %s, written as NULL',
+                           sorted(unknown))
+        return rows
+
+
+refdata = ReferenceCache()
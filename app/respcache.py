@@ -0,0 +1,81 @@
+import hashlib
+import threading
+import time
+from http import HTTPStatus
+from typing import Hashable, Iterable, Optional
+
+import requests
+from settings import RESPONSE_CACHE_MAX_AGE_SEC
+
+
+class ResponseCache:
+    # keeps only the ETag and a digest of the last body per key, not the
+    # body itself: an unchanged payload means there is nothing to write.
+    # A new payload stays pending until commit(), so a body whose rows
+    # never reached the database is not skipped as unchanged next time
+    def __init__(self, max_age_sec: float = RESPONSE_CACHE_MAX_AGE_SEC
+                 ) -> None:
+        self.max_age_sec = max_age_sec
+        self.hits = 0
+        self.lookups = 0
+        self._entries: dict[Hashable, tuple[Optional[str], bytes, float]] = {}
+        self._pending: dict[Hashable, tuple[Optional[str], bytes, float]] = {}
+        self._lock = threading.Lock()
+
+    def _fresh_entry(self, key: Hashable) -> Optional[tuple]:
+        entry = self._entries.get(key)
+        # past max age the payload is handled as new even if it is not
+        if entry is None or time.time() - entry[2] > self.max_age_sec:
+            return None
+        return entry
+
+    def fresh(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._fresh_entry(key) is not None
+
+    def request_headers(self, key: Hashable) -> dict[str, str]:
+        with self._lock:
+            entry = self._fresh_entry(key)
+        if entry is None or entry[0] is None:
+            return {}
+        return {'If-None-Match': entry[0]}
+
+    def unchanged(self, key: Hashable, response: requests.Response) -> bool:
+        digest = hashlib.blake2b(response.content, digest_size=16).digest()
+        with self._lock:
+            self.lookups += 1
+            entry = self._fresh_entry(key)
+            if entry is not None and (
+                    response.status_code == HTTPStatus.NOT_MODIFIED
+                    or entry[1] == digest):
+                self.hits += 1
+                return True
+            if response.status_code == HTTPStatus.NOT_MODIFIED:
+                # nothing left to compare with, the caller has to ask again
+                # without If-None-Match
+                self._entries.pop(key, None)
+                return False
+            self._pending[key] = (response.headers.get('ETag'), digest,
+                                  time.time())
+            return False
+
+    def commit(self, keys: Iterable[Hashable]) -> None:
+        with self._lock:
+            for key in keys:
+                entry = self._pending.pop(key, None)
+                if entry is not None:
+                    self._entries[key] = entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._pending.clear()
+
+    def pop_stats(self) -> tuple[int, int]:
+        with self._lock:
+            stats = self.hits, self.lookups
+            self.hits = self.lookups = 0
+        return stats
+
+
+forecast_cache = ResponseCache()
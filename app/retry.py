@@ -0,0 +1,58 @@
+import math
+import random
+import time
+from dataclasses import dataclass
+from http import HTTPStatus
+from typing import Optional
+
+from settings import (BACKOFF_BASE_SEC, BACKOFF_MAX_SEC, CONNECT_TIMEOUT_SEC,
+                      MAX_REQUEST_RETRIES, READ_TIMEOUT_SEC,
+                      REQUEST_DEADLINE_SEC)
+
+MIN_TIMEOUT_SEC = 0.001
+
+
+class Deadline:
+    def __init__(self, seconds: Optional[float] = None,
+                 parent: Optional['Deadline'] = None) -> None:
+        self.expires_at = (time.monotonic() + seconds
+                           if seconds is not None else math.inf)
+        if parent is not None:
+            self.expires_at = min(self.expires_at, parent.expires_at)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = MAX_REQUEST_RETRIES
+    connect_timeout: float = CONNECT_TIMEOUT_SEC
+    read_timeout: float = READ_TIMEOUT_SEC
+    backoff_base: float = BACKOFF_BASE_SEC
+    backoff_max: float = BACKOFF_MAX_SEC
+    request_deadline: Optional[float] = REQUEST_DEADLINE_SEC
+
+    def timeout(self, deadline: Deadline) -> tuple[float, float]:
+        # requests rejects a zero timeout, a deadline that runs out in
+        # between still ends the call almost at once
+        remaining = max(deadline.remaining(), MIN_TIMEOUT_SEC)
+        return (min(self.connect_timeout, remaining),
+                min(self.read_timeout, remaining))
+
+    def backoff(self, attempt: int) -> float:
+        # "full jitter": uniform in [0, base * 2 ** attempt], capped
+        cap = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return random.uniform(0, cap)
+
+    @staticmethod
+    def is_retryable_status(status_code: int) -> bool:
+        return (status_code == HTTPStatus.TOO_MANY_REQUESTS
+                or status_code >= HTTPStatus.INTERNAL_SERVER_ERROR)
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
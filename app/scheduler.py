@@ -0,0 +1,136 @@
+import math
+import signal
+import threading
+import time
+import zlib
+from typing import Callable, Optional
+
+from settings import (OVERLAP_POLICY, STAGGER_BATCH_SIZE,
+                      WEATHER_INTERVAL_SEC, logger)
+
+
+class Job:
+    def __init__(self, name: str, func: Callable[[], None],
+                 interval_sec: float, overlap: str = OVERLAP_POLICY,
+                 run_on_start: bool = False) -> None:
+        self.name = name
+        self.func = func
+        self.interval_sec = interval_sec
+        self.overlap = overlap
+        self.next_run = time.time() if run_on_start else self._next_slot()
+        self.queued = False
+        self.thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    # slots are aligned to the epoch, an hourly job runs at minute 0 just
+    # like the cron entry it replaces
+    def _next_slot(self, now: Optional[float] = None) -> float:
+        now = time.time() if now is None else now
+        return (now // self.interval_sec + 1) * self.interval_sec
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def trigger(self, now: float) -> None:
+        self.next_run = self._next_slot(now)
+        with self._lock:
+            if self.running:
+                if self.overlap == 'queue':
+                    self.queued = True
+                    logger.warning('%s is still running, cycle queued',
+                                   self.name)
+                else:
+                    logger.warning('%s is still running, cycle skipped',
+                                   self.name)
+                return
+            self.thread = threading.Thread(
+                target=self._run, name=self.name, daemon=True)
+            self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.func()
+            except Exception:
+                logger.exception('%s failed', self.name)
+            with self._lock:
+                if not self.queued:
+                    return
+                self.queued = False
+
+
+class Scheduler:
+    def __init__(self) -> None:
+        self.jobs: list[Job] = []
+        self._stop = threading.Event()
+
+    def add_job(self, name: str, func: Callable[[], None],
+                interval_sec: float, **kwargs) -> Job:
+        job = Job(name, func, interval_sec, **kwargs)
+        self.jobs.append(job)
+        return job
+
+    def stop(self, signum: Optional[int] = None, frame=None) -> None:
+        if signum is not None:
+            logger.info('received %s, shutting down',
+                        signal.Signals(signum).name)
+        self._stop.set()
+
+    def run(self, handle_signals: bool = True) -> None:
+        if handle_signals:
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+        logger.info('scheduler started with jobs: %s', ', '.join(
+            f'{job.name} every {job.interval_sec}s' for job in self.jobs))
+
+        while not self._stop.is_set():
+            now = time.time()
+            for job in self.jobs:
+                if job.next_run <= now:
+                    job.trigger(now)
+            next_run = min(job.next_run for job in self.jobs)
+            self._stop.wait(max(0.0, next_run - time.time()))
+
+        for job in self.jobs:
+            job.queued = False
+            if job.running:
+                logger.info('waiting for %s to finish', job.name)
+                job.thread.join()
+        logger.info('scheduler stopped')
+
+
+def city_offset(city_id: int, interval_sec: int) -> int:
+    # crc32 rather than hash(): it has to be the same in every process
+    return zlib.crc32(str(city_id).encode()) % interval_sec
+
+
+class StaggeredFetch:
+    def __init__(self, get_cities: Callable[[], list],
+                 fetch: Callable[[list], None],
+                 default_interval_sec: int = WEATHER_INTERVAL_SEC,
+                 batch_size: int = STAGGER_BATCH_SIZE) -> None:
+        self.get_cities = get_cities
+        self.fetch = fetch
+        self.default_interval_sec = default_interval_sec
+        self.batch_size = batch_size
+        self._last_tick = time.time()
+
+    def due_cities(self, start: float, end: float) -> list:
+        due = []
+        for c in self.get_cities():
+            interval = c.fetch_interval_sec or self.default_interval_sec
+            offset = city_offset(c.id, interval)
+            # a city is due at k * interval + offset, is there one such
+            # moment in (start, end]?
+            if (math.floor((end - offset) / interval)
+                    > math.floor((start - offset) / interval)):
+                due.append(c)
+        return due
+
+    def __call__(self) -> None:
+        now = time.time()
+        due = self.due_cities(self._last_tick, now)
+        self._last_tick = now
+        for i in range(0, len(due), self.batch_size):
+            self.fetch(due[i:i + self.batch_size])
@@ -1,5 +1,6 @@
 import logging
 import os
+import socket
 import sys
 
 from dotenv import load_dotenv
@@ -9,7 +10,51 @@ load_dotenv()
 API_KEY = os.environ.get('API_KEY')
 MAX_REQUEST_RETRIES = 3
 FETCH_INTERVAL_SEC = 3600
-REQUEST_TIMEOUT_SEC = 5
+WEATHER_INTERVAL_SEC = FETCH_INTERVAL_SEC
+FORECAST_INTERVAL_SEC = FETCH_INTERVAL_SEC
+REFDATA_REFRESH_SEC = 300
+DAEMON_RUN_ON_START = False
+OVERLAP_POLICY = 'skip'
+STAGGERED_SCHEDULING = False
+STAGGER_TICK_SEC = 60
+STAGGER_BATCH_SIZE = 100
+# SHARDING
+SHARDING_ENABLED = os.environ.get('SHARDING_ENABLED', '').lower() == 'true'
+SHARD_WORKER_ID = (os.environ.get('SHARD_WORKER_ID')
+                   or f'{socket.gethostname()}-{os.getpid()}')
+SHARD_HEARTBEAT_SEC = 10
+SHARD_LEASE_TTL_SEC = 30
+SHARD_VNODES = 64
+
+CONNECT_TIMEOUT_SEC = 3.05
+READ_TIMEOUT_SEC = 10
+BACKOFF_BASE_SEC = 1
+BACKOFF_MAX_SEC = 30
+REQUEST_DEADLINE_SEC = 60
+CYCLE_DEADLINE_SEC = FETCH_INTERVAL_SEC - 300
+FETCH_CONCURRENCY = 50
+# worker processes that parse and validate responses, 0 keeps it in the
+# fetch threads; needs COLUMNAR_BATCHES
+CPU_WORKERS = int(os.environ.get('CPU_WORKERS', 0))
+API_CALLS_PER_MINUTE = 60
+# shared by every collector process through the api_usage table, each
+# process claims calls from it this many at a time
+API_CALLS_PER_DAY = 33_000
+API_QUOTA_CLAIM_CALLS = 50
+GEOCODE_CHUNK_SIZE = 200
+
+# GEOCODING CACHE
+GEOCACHE_PATH = os.environ.get('GEOCACHE_PATH', 'geocache.sqlite3')
+GEOCACHE_TTL_SEC = 90 * 24 * 3600
+
+# API RESPONSE CACHE
+RESPONSE_CACHE_MAX_AGE_SEC = 6 * 3600
+
+# HTTP CONNECTION POOL
+HTTP_POOL_CONNECTIONS = 4
+HTTP_POOL_MAXSIZE = FETCH_CONCURRENCY
+HTTP_POOL_BLOCK = True
+HTTP_KEEP_ALIVE = True
 
 # CONSTRAINTS
 CONSTR = {
@@ -38,11 +83,39 @@ DB = os.environ.get('POSTGRES_DB')
 USER = os.environ.get('POSTGRES_USER')
 PASS = os.environ.get('POSTGRES_PASSWORD')
 DATABASE_URL = f'postgresql://{USER}:{PASS}@db:5432/{DB}'
+BULK_WRITE_METHOD = 'copy'
+ON_CONFLICT_MODE = 'nothing'
+PARTITION_PRECREATE_MONTHS = 2
+WEATHER_FACT_RETENTION_MONTHS = None
+ROLLUPS_ENABLED = True
+COPY_CHUNK_ROWS = 1000
+COLUMNAR_BATCHES = True
+
+# WRITE SPOOL
+SPOOL_PATH = os.environ.get('SPOOL_PATH', 'spool.jsonl')
+SPOOL_MAX_BYTES = 512 * 2 ** 20
+SPOOL_FSYNC_RECORDS = 10
+SPOOL_FSYNC_INTERVAL_SEC = 1
+SPOOL_DRAIN_SEC = 60
+
+# METRICS
+# served over HTTP by the daemon, 0 disables the endpoint
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 8000))
+# written after a one-off run for a textfile collector
+METRICS_TEXTFILE_PATH = os.environ.get('METRICS_TEXTFILE_PATH',
+                                       'metrics.prom')
+
+# STREAMING PIPELINE
+PIPELINE_BATCH_ROWS = 5000
+PIPELINE_QUEUE_DEPTH = 100
+PIPELINE_WRITERS = 2
 
 # API URLs
 BASE_URL = 'http://api.openweathermap.org/data/2.5/'
 WEATHER_BASE_URL = BASE_URL + 'weather'
 FORECAST_BASE_URL = BASE_URL + 'forecast'
+GROUP_BASE_URL = BASE_URL + 'group'
+MAX_BATCH_SIZE = 20
 CITY_DATA_BASE_URL = 'http://api.openweathermap.org/geo/1.0/direct'
 
 # logger settings
@@ -0,0 +1,103 @@
+import bisect
+import hashlib
+import threading
+from datetime import timedelta
+from typing import Iterable, Optional
+
+from db.models import CollectorLeaseModel
+from db.session import engine
+from ratelimit import rate_limiter
+from settings import (SHARD_LEASE_TTL_SEC, SHARD_VNODES, SHARD_WORKER_ID,
+                      logger)
+from sqlalchemy import Connection, delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+
+
+def ring_hash(value: str) -> int:
+    # stable across processes and hosts, unlike hash()
+    return int.from_bytes(
+        hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    # every worker is placed on the ring vnodes times, a city belongs to
+    # the first point clockwise from its own hash. A worker joining or
+    # leaving only moves the cities next to its points, about 1/N of them
+    def __init__(self, members: Iterable[str],
+                 vnodes: int = SHARD_VNODES) -> None:
+        self.members = frozenset(members)
+        points = sorted((ring_hash(f'{member}#{i}'), member)
+                        for member in self.members for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [member for _, member in points]
+        self._cache: dict[int, str] = {}
+
+    def owner(self, city_id: int) -> Optional[str]:
+        if not self._hashes:
+            return None
+        owner = self._cache.get(city_id)
+        if owner is None:
+            i = bisect.bisect(self._hashes, ring_hash(str(city_id)))
+            owner = self._owners[i % len(self._owners)]
+            self._cache[city_id] = owner
+        return owner
+
+
+def heartbeat(connection: Connection, worker_id: str,
+              ttl_sec: float) -> list[str]:
+    # database time only, clocks of the workers don't have to agree
+    connection.execute(
+        insert(CollectorLeaseModel)
+        .values(worker_id=worker_id)
+        .on_conflict_do_update(index_elements=['worker_id'],
+                               set_={'heartbeat_at': func.now()}))
+    connection.execute(delete(CollectorLeaseModel).where(
+        CollectorLeaseModel.heartbeat_at
+        < func.now() - timedelta(seconds=ttl_sec)))
+    return list(connection.scalars(
+        select(CollectorLeaseModel.worker_id)
+        .order_by(CollectorLeaseModel.worker_id)))
+
+
+def release(connection: Connection, worker_id: str) -> None:
+    connection.execute(delete(CollectorLeaseModel).where(
+        CollectorLeaseModel.worker_id == worker_id))
+
+
+class Shard:
+    # the live leases define the ring, so a worker that stops heartbeating
+    # drops out of it after ttl_sec and its cities go to the others. Views
+    # may disagree for up to one heartbeat, a city can then be fetched
+    # twice, which the writes tolerate, or skipped for a cycle
+    def __init__(self, worker_id: str = SHARD_WORKER_ID,
+                 ttl_sec: float = SHARD_LEASE_TTL_SEC,
+                 vnodes: int = SHARD_VNODES) -> None:
+        self.worker_id = worker_id
+        self.ttl_sec = ttl_sec
+        self.vnodes = vnodes
+        self.ring = HashRing((), vnodes)
+        self.rate_limiter = rate_limiter
+        self._lock = threading.Lock()
+
+    def heartbeat(self) -> None:
+        with engine.begin() as connection:
+            members = heartbeat(connection, self.worker_id, self.ttl_sec)
+        with self._lock:
+            if frozenset(members) == self.ring.members:
+                return
+            self.ring = HashRing(members, self.vnodes)
+        self.rate_limiter.set_workers(len(members))
+        logger.info('shard ring changed, %d workers: %s', len(members),
+                    ', '.join(members))
+
+    def release(self) -> None:
+        with engine.begin() as connection:
+            release(connection, self.worker_id)
+        logger.info('released shard lease of %s', self.worker_id)
+
+    def filter(self, cities: Iterable) -> list:
+        ring = self.ring
+        return [c for c in cities if ring.owner(c.id) == self.worker_id]
+
+
+shard = Shard()
@@ -0,0 +1,17 @@
+import sys
+
+import pytest
+
+sys.path.append('app/')
+
+import ratelimit
+import workers
+
+
+@pytest.fixture(autouse=True)
+def no_api_limits(monkeypatch):
+    # the shared limiter keeps its daily quota in PostgreSQL and its minute
+    # budget across tests, unit tests get an unlimited one
+    monkeypatch.setattr(ratelimit.rate_limiter, 'quota', None)
+    monkeypatch.setattr(workers.Fetcher, 'rate_limiter',
+                        ratelimit.RateLimiter())
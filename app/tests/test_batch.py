@@ -0,0 +1,72 @@
+import datetime
+import pickle
+import sys
+
+sys.path.append('app/')
+
+from db.batch import WeatherBatch
+from db.schemas import validate_weather_rows
+from utils import read_file
+from workers import ForecastFetcher
+
+
+def forecast_rows() -> list[dict]:
+    fetcher = ForecastFetcher(1, 1, 1, 1)
+    response = read_file('app/tests/fixture_files/sample_forecast.json')
+    return [fetcher._construct_mapping(item) for item in response['list']]
+
+
+def test_batch_round_trips_rows():
+    rows = forecast_rows()
+    batch = WeatherBatch.from_rows(rows)
+    assert len(batch) == len(rows)
+    assert batch.columns['temp'].dtype == 'float64'
+    assert list(batch) == rows
+
+
+def test_batch_pickles_as_packed_arrays():
+    rows = forecast_rows()
+    rows[0]['wind_gust'] = None
+    batch = pickle.loads(pickle.dumps(WeatherBatch.from_rows(rows)))
+    assert batch.columns['city'].dtype == 'int32'
+    assert batch.columns['timestamp'].flags.c_contiguous
+    assert list(batch) == rows
+    assert len(pickle.loads(pickle.dumps(WeatherBatch.from_rows([])))) == 0
+
+
+def test_batch_validation_matches_schema():
+    rows = forecast_rows()
+    rows[1]['humidity'] = 101
+    rows[2]['temp'] = rows[2]['temp_min'] = rows[2]['temp_max'] = None
+    rows[3]['pressure'] = 'high'
+    rows[4]['timestamp'] = None
+    valid, errors = WeatherBatch.from_rows(rows).validated()
+    assert list(valid) == validate_weather_rows(rows)[0]
+    assert errors == {'humidity': 1, 'temperature': 1, 'pressure': 1,
+                      'timestamp': 1}
+
+
+def test_batch_reads_epoch_timestamps_as_utc():
+    batch = WeatherBatch.from_rows([{'timestamp': 1.0, 'city': 1}])
+    assert batch[0]['timestamp'] == datetime.datetime(1970, 1, 1, 0, 0, 1)
+
+
+def test_batch_csv_stream_renders_nulls_and_timestamps():
+    batch = WeatherBatch.from_rows([
+        {'timestamp': datetime.datetime(2023, 10, 14, 21, 0),
+         'temp': 285.5, 'wind_gust': None, 'city': i} for i in range(3)])
+    stream = batch.csv_stream(['timestamp', 'temp', 'wind_gust', 'city'])
+    assert stream.read().decode().splitlines() == [
+        f'2023-10-14T21:00:00.000000,285.5,,{i}' for i in range(3)]
+
+
+def test_batch_null_unknown_and_touched_hours():
+    timestamp = datetime.datetime(2023, 10, 14, 21, 30)
+    batch = WeatherBatch.from_rows([
+        {'timestamp': timestamp, 'city': 1, 'condition': 800},
+        {'timestamp': timestamp, 'city': 2, 'condition': 999}])
+    assert batch.null_unknown('condition', {800}) == [999]
+    assert [row['condition'] for row in batch] == [800, None]
+    assert batch.touched_hours() == {
+        (1, datetime.datetime(2023, 10, 14, 21)),
+        (2, datetime.datetime(2023, 10, 14, 21))}
@@ -0,0 +1,48 @@
+import datetime
+import sys
+
+from sqlalchemy import column, table
+
+sys.path.append('app/')
+
+from db import bulk
+from db.bulk import CSVStream
+from db.models import WeatherFactModel
+
+
+def test_csv_stream_renders_rows_in_small_reads():
+    rows = [{'timestamp': datetime.datetime(2023, 10, 14, 21, 0),
+             'temp': 285.5, 'wind_gust': None, 'city': i}
+            for i in range(3)]
+    stream = CSVStream(rows, ['timestamp', 'temp', 'wind_gust', 'city'])
+    chunks = []
+    while chunk := stream.read(7):
+        chunks.append(chunk)
+    assert all(len(c) <= 7 for c in chunks)
+    assert b''.join(chunks).decode().splitlines() == [
+        f'2023-10-14 21:00:00,285.5,,{i}' for i in range(3)]
+
+
+def test_csv_stream_quotes_text_values():
+    stream = CSVStream([{'name': 'Washington, D.C.', 'state': None}],
+                       ['name', 'state'])
+    assert stream.read() == b'"Washington, D.C.",\n'
+    assert stream.read() == b''
+
+
+def test_merge_counts_never_go_negative(monkeypatch):
+    # another writer inserted one of the two new keys in between
+    class Connection:
+        def execute(self, statement):
+            return self
+
+        def scalar(self):
+            return 1
+
+    target = WeatherFactModel.__table__
+    staging = table('staging', *(column(c.name) for c in target.columns))
+    monkeypatch.setattr(bulk, 'count_existing',
+                        lambda connection, target, staging: (2, 0))
+    inserted, written = bulk.merge_staging(Connection(), target, staging,
+                                           'update')
+    assert (inserted, written - inserted) == (1, 0)
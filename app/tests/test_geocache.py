@@ -0,0 +1,53 @@
+import sys
+
+import pytest
+
+sys.path.append('app/')
+
+import workers
+from geocache import GeoCache, make_key
+from utils import read_file
+from workers import CityFetcher
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = GeoCache(str(tmp_path / 'geocache.sqlite3'), ttl_sec=60)
+    yield cache
+    cache.close()
+
+
+@pytest.mark.parametrize('query, country, expected', [
+    ('São Paulo', None, 'são paulo|'),
+    ('  SÃO   paulo , BR ', None, 'são paulo|br'),
+    ('Paris', 'FR', 'paris|fr'),
+    ('Springfield, Illinois, US', None, 'springfield, illinois|us'),
+])
+def test_make_key_normalizes_name_and_country(query, country, expected):
+    assert make_key(query, country) == expected
+
+
+def test_cache_get_put_and_ttl(cache, monkeypatch):
+    assert cache.get('Tokyo') is None
+    cache.put('Tokyo', [{'lat': 35.68}])
+    assert cache.get(' tokyo ') == [{'lat': 35.68}]
+    monkeypatch.setattr('geocache.time.time', lambda: 1e12)
+    assert cache.get('Tokyo') is None
+
+
+def test_cache_invalidate(cache):
+    cache.put('Tokyo', [{}])
+    cache.put('Delhi', [{}])
+    assert cache.invalidate('TOKYO') == 1
+    assert cache.get('Tokyo') is None
+    assert cache.invalidate() == 1
+
+
+def test_city_fetcher_asks_api_once(cache, monkeypatch, requests_mock):
+    monkeypatch.setattr(workers, 'get_geocache', lambda: cache)
+    response = read_file('app/tests/fixture_files/sample_city_info.json')
+    requests_mock.get(CityFetcher('').url, json=response)
+    first = CityFetcher('São Paulo').run
+    second = CityFetcher(' SÃO PAULO').run
+    assert first == second != []
+    assert requests_mock.call_count == 1
@@ -0,0 +1,82 @@
+import sys
+
+from sqlalchemy.exc import OperationalError
+
+sys.path.append('app/')
+
+import main
+import pipeline
+import utils
+from db.bulk import WriteResult
+from refdata import City
+
+
+def test_load_cities_skips_resolved_and_commits_in_chunks(monkeypatch,
+                                                           caplog):
+    written = []
+    monkeypatch.setattr(main, 'read_file', lambda filename: [
+        'Tokyo', 'Delhi', 'Delhi', 'Cairo', 'Atlantis', 'Lagos'])
+    monkeypatch.setattr(main, 'get_geocoded_names', lambda: {'Tokyo'})
+    monkeypatch.setattr(main, 'GEOCODE_CHUNK_SIZE', 2)
+    monkeypatch.setattr(main, 'run_concurrently', lambda fetchers: [
+        [] if f.params['q'] == 'Atlantis' else [{'name': f.params['q']}]
+        for f in fetchers])
+    monkeypatch.setattr(main, 'upsert_cities',
+                        lambda data: written.append(data) or len(data))
+
+    with caplog.at_level('INFO', logger=main.logger.name):
+        main.load_cities()
+
+    assert written == [
+        [{'name': 'Delhi', 'query_name': 'Delhi'},
+         {'name': 'Cairo', 'query_name': 'Cairo'}],
+        [{'name': 'Lagos', 'query_name': 'Lagos'}],
+    ]
+    assert '1 of 5 cities already geocoded, 4 to go' in caplog.text
+    assert 'got data for 3 of 4 cities' in caplog.text
+
+
+def test_collect_writes_rows_while_database_is_down(monkeypatch):
+    def down(*args, **kwargs):
+        raise OperationalError('SELECT 1', {}, Exception('db is down'))
+
+    class FakeFetcher:
+        def __init__(self, cur_time, city_id, latitude, longitude,
+                     deadline=None):
+            self.city_id = city_id
+            self.owm_id = 100 + city_id
+            self.result = [{'city': city_id}]
+
+    def run_streaming(fetchers, sink, concurrency):
+        for fetcher in fetchers:
+            sink(fetcher, fetcher.result)
+
+    written = []
+    monkeypatch.setattr(utils.engine, 'begin', down)
+    monkeypatch.setattr(utils, 'get_session', down)
+    monkeypatch.setattr(pipeline, 'COLUMNAR_BATCHES', False)
+    monkeypatch.setattr(pipeline, 'run_streaming', run_streaming)
+    monkeypatch.setattr(main, 'COLUMNAR_BATCHES', False)
+    monkeypatch.setattr(main, 'WeatherFetcher', FakeFetcher)
+    monkeypatch.setattr(main, 'write_results',
+                        lambda kind, data: written.append((kind, data)))
+
+    main.collect([City(1, 55.75, 37.61, None, None),
+                  City(2, 59.94, 30.31, None, None)], forecast=False)
+
+    assert written == [('weather', [{'city': 1}, {'city': 2}])]
+
+
+def test_write_results_commits_only_written_forecasts(monkeypatch):
+    committed = []
+    results = iter([WriteResult(inserted=2), WriteResult(skipped=1),
+                    WriteResult(spooled=1)])
+    monkeypatch.setattr(main, 'refresh_in_db',
+                        lambda model, data: next(results))
+    monkeypatch.setattr(main.forecast_cache, 'commit', committed.append)
+
+    main.write_results('forecast', [{'city': 1}, {'city': 1}])
+    main.write_results('forecast', [{'city': 2}])
+    main.write_results('forecast', [{'city': 3}])
+
+    assert committed == [{1}]
@@ -0,0 +1,104 @@
+import sys
+import urllib.request
+
+import pytest
+
+sys.path.append('app/')
+
+import metrics
+from db.bulk import WriteResult
+from db.models import WeatherFactModel
+from metrics import (API_RESPONSES, API_RETRIES, ROWS_WRITTEN,
+                     VALIDATION_FAILURES, Counter, Histogram, timed)
+from retry import RetryPolicy
+from settings import FORECAST_BASE_URL
+from utils import measure_write, read_file
+from workers import ForecastFetcher, WeatherFetcher
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(metrics, 'REGISTRY', [])
+    return metrics.REGISTRY
+
+
+def test_counter_renders_labels_escaped(registry):
+    counter = Counter('test_total', 'A counter', ['table', 'result'])
+    counter.inc('weather_fact', 'inserted', amount=40)
+    counter.inc('weather_fact', 'inserted')
+    counter.inc('a"b\\c', 'x')
+    assert metrics.render() == (
+        '# HELP test_total A counter\n'
+        '# TYPE test_total counter\n'
+        'test_total{table="a\\"b\\\\c",result="x"} 1\n'
+        'test_total{table="weather_fact",result="inserted"} 41\n')
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = Histogram('test_seconds', 'A histogram', ['endpoint'],
+                          buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, 'forecast')
+    with timed(histogram, 'weather'):
+        pass
+    lines = metrics.render().splitlines()
+    assert lines[2:7] == [
+        'test_seconds_bucket{endpoint="forecast",le="0.1"} 2',
+        'test_seconds_bucket{endpoint="forecast",le="1"} 3',
+        'test_seconds_bucket{endpoint="forecast",le="+Inf"} 4',
+        'test_seconds_sum{endpoint="forecast"} 3.65',
+        'test_seconds_count{endpoint="forecast"} 4',
+    ]
+    assert histogram.value('weather')[1] == 1
+
+
+def test_metrics_are_served_and_written(registry, tmp_path):
+    Counter('test_total', 'A counter').inc()
+    server = metrics.start_http_server(0, '127.0.0.1')
+    try:
+        url = f'http://127.0.0.1:{server.server_port}/metrics'
+        with urllib.request.urlopen(url) as response:
+            assert response.headers['Content-Type'] == metrics.CONTENT_TYPE
+            assert response.read().decode() == metrics.render()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    path = tmp_path / 'metrics.prom'
+    metrics.write_textfile(str(path))
+    assert path.read_text().endswith('test_total 1\n')
+    assert [p.name for p in tmp_path.iterdir()] == ['metrics.prom']
+
+
+def test_fetchers_count_responses_and_retries(requests_mock):
+    requests_mock.get(FORECAST_BASE_URL, [
+        {'status_code': 502},
+        {'json': read_file('app/tests/fixture_files/sample_forecast.json')}])
+    responses = API_RESPONSES.value('forecast', '200')
+    retries = API_RETRIES.value('forecast')
+    fetcher = ForecastFetcher(1, 1, 1, 1)
+    fetcher.response_cache = None
+    fetcher.retry_policy = RetryPolicy(backoff_base=0)
+    assert fetcher.run
+    assert API_RESPONSES.value('forecast', '502') >= 1
+    assert API_RESPONSES.value('forecast', '200') == responses + 1
+    assert API_RETRIES.value('forecast') == retries + 1
+
+
+def test_validation_failures_are_counted_per_field():
+    failures = VALIDATION_FAILURES.value('humidity')
+    response = read_file('app/tests/fixture_files/sample_weather.json')
+    response['main']['humidity'] = 101
+    assert WeatherFetcher(1, 1, 1, 1)._process_response(response) == []
+    assert VALIDATION_FAILURES.value('humidity') == failures + 1
+
+
+def test_written_rows_are_counted_per_table():
+    @measure_write('insert')
+    def write(model, data):
+        return WriteResult(inserted=2, skipped=1)
+
+    inserted = ROWS_WRITTEN.value('weather_fact', 'inserted')
+    write(WeatherFactModel, [{}, {}, {}])
+    assert ROWS_WRITTEN.value('weather_fact', 'inserted') == inserted + 2
+    assert ROWS_WRITTEN.value('weather_fact', 'skipped') >= 1
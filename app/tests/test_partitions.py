@@ -0,0 +1,27 @@
+import sys
+from datetime import date
+
+import pytest
+
+sys.path.append('app/')
+
+from db.partitions import add_months, month_start, partition_name
+
+
+@pytest.mark.parametrize('month, months, expected', [
+    (date(2023, 10, 1), 0, date(2023, 10, 1)),
+    (date(2023, 10, 1), 3, date(2024, 1, 1)),
+    (date(2023, 1, 1), -1, date(2022, 12, 1)),
+    (date(2023, 12, 1), -24, date(2021, 12, 1)),
+])
+def test_add_months(month, months, expected):
+    assert add_months(month, months) == expected
+
+
+def test_month_start():
+    assert month_start(date(2023, 10, 31)) == date(2023, 10, 1)
+
+
+def test_partition_name():
+    assert (partition_name('weather_fact', date(2023, 2, 1))
+            == 'weather_fact_2023_02')
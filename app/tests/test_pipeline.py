@@ -0,0 +1,92 @@
+import sys
+import threading
+
+import pytest
+
+sys.path.append('app/')
+
+import pipeline
+from pipeline import Pipeline
+
+
+@pytest.fixture
+def fake_fetch(monkeypatch):
+    monkeypatch.setattr(pipeline, 'COLUMNAR_BATCHES', False)
+
+    def run_streaming(fetchers, sink, concurrency):
+        for fetcher in fetchers:
+            sink(fetcher, fetcher.result)
+
+    monkeypatch.setattr(pipeline, 'run_streaming', run_streaming)
+
+
+class FakeFetcher:
+    def __init__(self, rows: int) -> None:
+        self.result = [{'city': i} for i in range(rows)]
+
+
+def test_pipeline_writes_micro_batches_per_kind(fake_fetch):
+    written = []
+    lock = threading.Lock()
+
+    def write(kind, data):
+        with lock:
+            written.append((kind, len(data)))
+
+    rows = Pipeline(write, batch_rows=4, writers=1).run(
+        [('weather', FakeFetcher(2)) for _ in range(5)]
+        + [('forecast', FakeFetcher(40)), ('forecast', FakeFetcher(0))])
+    assert written == [('weather', 4), ('weather', 4), ('forecast', 40),
+                       ('weather', 2)]
+    assert rows == {'weather': 10, 'forecast': 40}
+
+
+def test_pipeline_keeps_going_after_failed_write(fake_fetch):
+    calls = []
+
+    def write(kind, data):
+        calls.append(len(data))
+        if len(calls) == 1:
+            raise RuntimeError('db is down')
+
+    line = Pipeline(write, batch_rows=2, writers=1)
+    rows = line.run([('weather', FakeFetcher(2)) for _ in range(3)])
+    assert calls == [2, 2, 2]
+    assert rows == {'weather': 4}
+    assert line.failed == {'weather': 2}
+
+
+def test_pipeline_survives_failed_combine(fake_fetch, monkeypatch):
+    def combine_rows(results):
+        if len(results) == 1:
+            raise ValueError('unexpected result')
+        return [row for result in results for row in result]
+
+    monkeypatch.setattr(pipeline, 'combine_rows', combine_rows)
+    written = []
+    stage = Pipeline(lambda kind, data: written.append(len(data)),
+                     batch_rows=4, queue_depth=1, writers=1)
+    rows = stage.run([('weather', FakeFetcher(5)),
+                      ('weather', FakeFetcher(2)),
+                      ('weather', FakeFetcher(2))])
+    assert stage.failed['weather'] == 5
+    assert rows['weather'] == 4 and written == [4]
+
+
+def test_pipeline_queue_is_bounded(monkeypatch):
+    release = threading.Event()
+    line = Pipeline(lambda kind, data: release.wait(5), batch_rows=1,
+                    queue_depth=2, writers=1)
+    sizes = []
+
+    def run_streaming(fetchers, sink, concurrency):
+        for fetcher in fetchers:
+            sizes.append(line.queue.qsize())
+            if len(sizes) == 4:
+                release.set()
+            sink(fetcher, fetcher.result)
+
+    monkeypatch.setattr(pipeline, 'run_streaming', run_streaming)
+    monkeypatch.setattr(pipeline, 'COLUMNAR_BATCHES', False)
+    line.run([('weather', FakeFetcher(1)) for _ in range(8)])
+    assert max(sizes) <= 2
@@ -0,0 +1,99 @@
+import sys
+import threading
+from datetime import timedelta
+
+import pytest
+
+sys.path.append('app/')
+
+import ratelimit
+from ratelimit import (DailyQuota, QuotaStore, RateLimiter,
+                       parse_retry_after, utc_today)
+
+
+def test_rate_limiter_lets_burst_through_up_to_minute_budget():
+    limiter = RateLimiter(calls_per_minute=5)
+    delays = [limiter.reserve() for _ in range(6)]
+    assert delays[:5] == [0.0] * 5
+    assert delays[5] == pytest.approx(12, abs=0.1)
+
+
+class MemoryStore(QuotaStore):
+    def __init__(self, used: int = 0) -> None:
+        self.used = {utc_today(): used}
+        self.claims = 0
+        self.lock = threading.Lock()
+
+    def claim(self, day, calls, limit, unrecorded=0):
+        with self.lock:
+            self.claims += 1
+            used = self.used.setdefault(day, 0)
+            granted = max(0, min(calls, limit - used - unrecorded))
+            self.used[day] = used + unrecorded + granted
+            return granted
+
+    def give_back(self, day, calls):
+        with self.lock:
+            self.used[day] -= calls
+
+
+class FailingStore(QuotaStore):
+    def claim(self, day, calls, limit, unrecorded=0):
+        raise OSError('database is down')
+
+
+def test_rate_limiter_day_budget_is_shared_and_persisted():
+    store = MemoryStore(used=95)
+    first = RateLimiter(calls_per_minute=1000, calls_per_day=100,
+                        quota_store=store)
+    second = RateLimiter(calls_per_minute=1000, calls_per_day=100,
+                         quota_store=store)
+    assert sum(first.acquire(max_wait=0.2) for _ in range(6)) == 5
+    assert not second.acquire(max_wait=0.2)
+    assert store.used[utc_today()] == 100
+
+
+def test_daily_quota_claims_blocks_and_gives_back_unused_calls():
+    store = MemoryStore()
+    quota = DailyQuota(1000, store, block=10)
+    assert all(quota.take(timeout=1) for _ in range(15))
+    assert store.claims == 2
+    quota.release()
+    assert store.used[utc_today()] == 15
+
+
+def test_daily_quota_waits_for_next_day_when_used_up(monkeypatch):
+    quota = DailyQuota(10, MemoryStore(used=10), block=5)
+    assert not quota.take(timeout=0.2)
+    tomorrow = utc_today() + timedelta(days=1)
+    monkeypatch.setattr(ratelimit, 'utc_today', lambda: tomorrow)
+    assert quota.take(timeout=1)
+
+
+def test_daily_quota_counts_locally_while_store_fails():
+    quota = DailyQuota(10, FailingStore(), block=4)
+    assert sum(quota.take(timeout=0.2) for _ in range(12)) == 8
+
+
+def test_rate_limiter_refunds_calls_that_would_wait_too_long():
+    limiter = RateLimiter(calls_per_minute=1)
+    assert limiter.acquire(max_wait=1)
+    assert limiter.reserve(max_wait=1) is None
+    assert limiter.reserve() == pytest.approx(60, abs=0.1)
+
+
+def test_rate_limiter_back_off_delays_next_call():
+    limiter = RateLimiter(calls_per_minute=100)
+    limiter.back_off(30)
+    assert limiter.reserve() == pytest.approx(30, abs=0.1)
+
+
+@pytest.mark.parametrize('prm, expected', [('120', 120),
+                                           ('-5', 0),
+                                           ('', 7),
+                                           (None, 7),
+                                           ('garbage', 7),
+                                           ('Wed, 21 Oct 2015 07:28:00 GMT',
+                                            0)])
+def test_parse_retry_after(prm, expected):
+    assert parse_retry_after(prm, default=7) == expected
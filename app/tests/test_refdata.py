@@ -0,0 +1,73 @@
+import math
+import sys
+from contextlib import nullcontext
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+sys.path.append('app/')
+
+import refdata as refdata_module
+from refdata import City, CityTable, ReferenceCache
+
+CITY_ROWS = [(1, 55.75, 37.61, 524901, None),
+             (2, None, None, None, 900)]
+
+
+def test_city_table_round_trip():
+    table = CityTable(CITY_ROWS)
+    assert len(table) == 2
+    assert table.ids.typecode == 'q'
+    assert table.latitude.typecode == 'd'
+    assert math.isnan(table.latitude[1])
+    assert list(table) == [City(*row) for row in CITY_ROWS]
+
+
+@pytest.fixture
+def versions(monkeypatch):
+    versions = {'cities': 1, 'conditions': 1}
+    loads = []
+    monkeypatch.setattr(refdata_module.engine, 'connect', nullcontext)
+    monkeypatch.setattr(refdata_module, 'load_versions',
+                        lambda connection: dict(versions))
+    monkeypatch.setattr(refdata_module.ReferenceCache, 'LOADERS', {
+        'cities': ('cities', lambda c: loads.append('cities') or
+                   CityTable(CITY_ROWS)),
+        'conditions': ('conditions', lambda c: loads.append('conditions') or
+                       frozenset({800, 802})),
+    })
+    return versions, loads
+
+
+def test_refresh_reloads_only_changed_tables(versions):
+    versions, loads = versions
+    cache = ReferenceCache()
+    assert cache.refresh() == ['cities', 'conditions']
+    assert cache.refresh() == []
+    versions['cities'] += 1
+    assert cache.refresh() == ['cities']
+    assert loads == ['cities', 'conditions', 'cities']
+    assert len(cache.cities) == 2
+    assert cache.conditions == {800, 802}
+
+
+def test_refresh_keeps_cached_tables_while_database_is_down(versions,
+                                                             monkeypatch):
+    cache = ReferenceCache()
+    cache.refresh()
+
+    def down():
+        raise OperationalError('SELECT 1', {}, Exception('db is down'))
+
+    monkeypatch.setattr(refdata_module.engine, 'connect', down)
+    versions[0]['cities'] += 1
+    assert cache.refresh() == []
+    assert len(cache.cities) == 2
+
+
+def test_check_conditions_nulls_unknown_ids():
+    cache = ReferenceCache()
+    cache.conditions = frozenset({800})
+    rows = [{'condition': 800}, {'condition': 999}, {'condition': None}]
+    assert cache.check_conditions(rows) == [
+        {'condition': 800}, {'condition': None}, {'condition': None}]
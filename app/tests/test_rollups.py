@@ -0,0 +1,85 @@
+import datetime
+import sys
+
+sys.path.append('app/')
+
+from db.batch import WeatherBatch
+from db.rollups import LEVELS, rebuild_rollups, touched_hours, update_rollups
+
+MSK = datetime.timezone(datetime.timedelta(hours=3))
+
+
+def weather_rows() -> list[dict]:
+    return [
+        {'city': 1, 'timestamp': datetime.datetime(2023, 10, 1, 12, 5)},
+        {'city': 1, 'timestamp': datetime.datetime(2023, 10, 1, 12, 55)},
+        {'city': 2, 'timestamp': datetime.datetime(2023, 10, 1, 13, 0)},
+        {'city': 1, 'timestamp': datetime.datetime(
+            2023, 10, 1, 16, 30, tzinfo=MSK)},
+    ]
+
+
+class FakeConnection:
+    def __init__(self) -> None:
+        self.statements = []
+
+    def execute(self, statement, params=None):
+        self.statements.append((' '.join(str(statement).split()), params))
+        return self
+
+    def exec_driver_sql(self, statement):
+        self.statements.append((statement, None))
+
+    rowcount = 1
+
+
+def test_touched_hours_of_rows_are_utc_hours():
+    assert touched_hours(weather_rows()) == {
+        (1, datetime.datetime(2023, 10, 1, 12)),
+        (2, datetime.datetime(2023, 10, 1, 13)),
+        (1, datetime.datetime(2023, 10, 1, 13)),
+    }
+
+
+def test_touched_hours_of_batch_match_rows():
+    rows = [row for row in weather_rows() if row['timestamp'].tzinfo is None]
+    assert (touched_hours(WeatherBatch.from_rows(rows))
+            == touched_hours(rows))
+
+
+def test_update_rollups_recomputes_touched_buckets_level_by_level():
+    connection = FakeConnection()
+    assert update_rollups(connection, weather_rows()) == len(LEVELS)
+
+    touched = connection.statements[2]
+    assert sorted(touched[1]['cities']) == [1, 1, 2]
+    assert len(touched[1]['buckets']) == 3
+    upserts = [sql for sql, _ in connection.statements[3:]]
+    assert len(upserts) == len(LEVELS)
+    for sql, (table, source, column, unit) in zip(upserts, LEVELS):
+        assert sql.startswith(f'INSERT INTO {table} ')
+        assert f"date_trunc('{unit}', s.{column}) AS bucket" in sql
+        assert f'FROM {source} s JOIN' in sql
+        assert f"date_trunc('{unit}', bucket)" in sql
+        assert f"s.{column} < t.bucket + interval '1 {unit}'" in sql
+        assert 'ON CONFLICT (city, bucket) DO UPDATE' in sql
+    assert 'sum(s.temp)' in upserts[0]
+    assert all('sum(s.temp_sum)' in sql for sql in upserts[1:])
+
+
+def test_update_rollups_skips_empty_writes():
+    connection = FakeConnection()
+    assert update_rollups(connection, []) == 0
+    assert connection.statements == []
+
+
+def test_rebuild_rollups_scopes_every_level_to_range():
+    connection = FakeConnection()
+    start = datetime.datetime(2023, 10, 1)
+    end = datetime.datetime(2023, 11, 1)
+    assert rebuild_rollups(connection, start, end) == len(LEVELS)
+    for (sql, params), (_, _, column, _) in zip(connection.statements,
+                                                LEVELS):
+        assert (f'WHERE s.{column} >= :start AND s.{column} < :end'
+                in sql)
+        assert params == {'start': start, 'end': end}
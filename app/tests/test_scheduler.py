@@ -0,0 +1,86 @@
+import sys
+import threading
+
+import pytest
+
+sys.path.append('app/')
+
+from db.models import CityModel
+from scheduler import Job, Scheduler, StaggeredFetch, city_offset
+
+
+def test_job_next_slot_is_aligned_to_interval():
+    job = Job('job', lambda: None, 3600)
+    assert job._next_slot(7200) == 10800
+    assert job._next_slot(7300.5) == 10800
+
+
+@pytest.mark.parametrize('overlap, expected_runs', [('skip', 1),
+                                                    ('queue', 2)])
+def test_job_overlapping_trigger(overlap, expected_runs):
+    release = threading.Event()
+    runs = []
+
+    def func():
+        runs.append(1)
+        release.wait(5)
+
+    job = Job('job', func, 60, overlap=overlap)
+    job.trigger(0)
+    job.trigger(0)
+    job.trigger(0)
+    release.set()
+    while job.running:
+        job.thread.join()
+    assert len(runs) == expected_runs
+
+
+def test_scheduler_stop_waits_for_running_job():
+    started, finished = threading.Event(), threading.Event()
+
+    def func():
+        started.set()
+        finished.wait(0.2)
+        finished.set()
+
+    scheduler = Scheduler()
+    scheduler.add_job('job', func, 3600, run_on_start=True)
+    thread = threading.Thread(target=scheduler.run, args=(False,))
+    thread.start()
+    assert started.wait(5)
+    scheduler.stop()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert finished.is_set()
+
+
+def test_city_offset_is_deterministic_and_in_range():
+    offsets = [city_offset(i, 3600) for i in range(1000)]
+    assert offsets == [city_offset(i, 3600) for i in range(1000)]
+    assert all(0 <= o < 3600 for o in offsets)
+    assert len(set(offsets)) > 800
+
+
+def test_staggered_fetch_spreads_cities_over_interval():
+    cities = [CityModel(id=i) for i in range(500)]
+    cities[0].fetch_interval_sec = 900
+    plan = StaggeredFetch(lambda: cities, lambda batch: None,
+                          default_interval_sec=3600)
+    due = [plan.due_cities(t, t + 60) for t in range(0, 3600, 60)]
+    counts = {}
+    for batch in due:
+        for c in batch:
+            counts[c.id] = counts.get(c.id, 0) + 1
+    assert counts[0] == 4
+    assert all(counts[i] == 1 for i in range(1, 500))
+    assert max(len(batch) for batch in due) < 30
+
+
+def test_staggered_fetch_writes_in_micro_batches():
+    cities = [CityModel(id=i) for i in range(10)]
+    batches = []
+    plan = StaggeredFetch(lambda: cities, batches.append,
+                          default_interval_sec=1, batch_size=4)
+    plan._last_tick -= 1
+    plan()
+    assert [len(b) for b in batches] == [4, 4, 2]
@@ -0,0 +1,44 @@
+import datetime
+import sys
+
+sys.path.append('app/')
+
+from db.schemas import WeatherSchema, validate_weather_rows
+
+ROW = {
+    'timestamp': datetime.datetime(2023, 10, 14, 21, 0),
+    'temp': 285.0,
+    'temp_min': 284.97,
+    'temp_max': 285.0,
+    'pressure': 1020,
+    'humidity': 69,
+    'wind_speed': 2.94,
+    'wind_direction': 313,
+    'wind_gust': None,
+    'clouds': 40,
+    'city': 1,
+    'condition': 802,
+}
+
+
+def test_validate_weather_rows_returns_dicts():
+    valid, errors = validate_weather_rows([ROW, ROW])
+    assert valid == [ROW, ROW]
+    assert errors == []
+
+
+def test_validate_weather_rows_reports_errors_per_row():
+    rows = [ROW,
+            {**ROW, 'humidity': 101, 'wind_direction': 361},
+            {**ROW, 'temp': None, 'temp_min': None, 'temp_max': None},
+            ROW]
+    valid, errors = validate_weather_rows(rows)
+    assert valid == [ROW, ROW]
+    assert [(e.index, e.field) for e in errors] == [
+        (1, 'humidity'), (1, 'wind_direction'), (2, None)]
+    assert 'temperature' in errors[2].message
+
+
+def test_weather_schema_shares_range_checks():
+    assert WeatherSchema.model_validate(ROW).model_dump() == ROW
+    assert validate_weather_rows([{**ROW, 'temp': 50.0}])[0] == []
@@ -0,0 +1,90 @@
+import sys
+from collections import Counter
+from contextlib import nullcontext
+
+sys.path.append('app/')
+
+import sharding
+from ratelimit import RateLimiter
+from refdata import City
+from sharding import HashRing, Shard
+
+CITY_IDS = range(1, 10_001)
+WORKERS = ['worker-a', 'worker-b', 'worker-c', 'worker-d']
+
+
+def owners(ring):
+    return {city_id: ring.owner(city_id) for city_id in CITY_IDS}
+
+
+def test_ring_is_deterministic_and_balanced():
+    assert owners(HashRing(WORKERS)) == owners(HashRing(reversed(WORKERS)))
+    shares = Counter(owners(HashRing(WORKERS)).values())
+    assert set(shares) == set(WORKERS)
+    # 64 points per worker keep every share within a third of the mean
+    for count in shares.values():
+        assert abs(count - len(CITY_IDS) / 4) < len(CITY_IDS) / 12
+
+
+def test_dead_worker_only_hands_over_its_own_cities():
+    before = owners(HashRing(WORKERS))
+    after = owners(HashRing(WORKERS[:-1]))
+    moved = {city for city in CITY_IDS if before[city] != after[city]}
+    assert moved == {city for city in CITY_IDS if before[city] == 'worker-d'}
+
+
+def test_new_worker_takes_about_its_share():
+    before = owners(HashRing(WORKERS))
+    after = owners(HashRing(WORKERS + ['worker-e']))
+    moved = [city for city in CITY_IDS if before[city] != after[city]]
+    assert all(after[city] == 'worker-e' for city in moved)
+    assert len(CITY_IDS) / 10 < len(moved) < len(CITY_IDS) * 3 / 10
+
+
+def test_empty_ring_owns_nothing():
+    assert HashRing([]).owner(1) is None
+    assert Shard('worker-a').filter([City(1, 0.0, 0.0, None, None)]) == []
+
+
+def test_shards_cover_every_city_once(monkeypatch):
+    members = list(WORKERS)
+    monkeypatch.setattr(sharding.engine, 'begin', nullcontext)
+    monkeypatch.setattr(sharding, 'heartbeat',
+                        lambda connection, worker_id, ttl_sec: members)
+    cities = [City(city_id, 0.0, 0.0, None, None) for city_id in CITY_IDS]
+    shards = {worker: Shard(worker) for worker in WORKERS}
+
+    def slices():
+        for shard in shards.values():
+            shard.heartbeat()
+        return {worker: {c.id for c in shard.filter(cities)}
+                for worker, shard in shards.items()}
+
+    taken = slices()
+    assert sum(map(len, taken.values())) == len(cities)
+    assert set().union(*taken.values()) == set(CITY_IDS)
+
+    # worker-d stops heartbeating, its lease expires
+    members.remove('worker-d')
+    del shards['worker-d']
+    retaken = slices()
+    assert set().union(*retaken.values()) == set(CITY_IDS)
+    for worker, cities_before in retaken.items():
+        assert taken[worker] <= cities_before
+
+
+def test_workers_split_the_minute_budget(monkeypatch):
+    members = list(WORKERS)
+    monkeypatch.setattr(sharding.engine, 'begin', nullcontext)
+    monkeypatch.setattr(sharding, 'heartbeat',
+                        lambda connection, worker_id, ttl_sec: members)
+    shard = Shard('worker-a')
+    shard.rate_limiter = RateLimiter(calls_per_minute=60)
+    shard.heartbeat()
+    delays = [shard.rate_limiter.reserve() for _ in range(16)]
+    assert delays[:15] == [0.0] * 15
+    assert delays[15] > 0
+
+    members[1:] = []
+    shard.heartbeat()
+    assert shard.rate_limiter._buckets[0].capacity == 60
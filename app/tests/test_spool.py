@@ -0,0 +1,110 @@
+import datetime
+import sys
+
+import pytest
+from sqlalchemy.exc import DataError, OperationalError
+
+sys.path.append('app/')
+
+import utils
+from db.models import WeatherFactModel
+from db.spool import Spool
+
+
+@pytest.fixture
+def spool(tmp_path):
+    spool = Spool(str(tmp_path / 'spool.jsonl'), fsync_records=2)
+    yield spool
+    spool.close()
+
+
+def unavailable():
+    return OperationalError('COPY', {}, Exception('connection refused'))
+
+
+def test_spool_replays_records_in_order(spool):
+    for i in range(3):
+        assert spool.append({'rows': [i]})
+    replayed = []
+    assert spool.drain(lambda record: replayed.append(record['rows'])) \
+        == (3, 0)
+    assert replayed == [[0], [1], [2]]
+    assert spool.drain(replayed.append) == (0, 0)
+
+
+def test_spool_keeps_unreplayed_records_while_db_is_down(spool):
+    for i in range(3):
+        spool.append({'rows': [i]})
+
+    def replay(record):
+        if record['rows'] == [1]:
+            raise unavailable()
+
+    assert spool.drain(replay) == (1, 0)
+    spool.append({'rows': [3]})
+    replayed = []
+    assert spool.drain(lambda record: replayed.append(record['rows'])) \
+        == (2, 0)
+    assert spool.drain(lambda record: replayed.append(record['rows'])) \
+        == (1, 0)
+    assert replayed == [[1], [2], [3]]
+
+
+def test_spool_rejects_bad_records_and_skips_torn_lines(spool):
+    spool.append({'rows': [0]})
+    spool.append({'rows': [1]})
+    spool.close()
+    with open(spool.path, 'ab') as file:
+        file.write(b'{"rows": [')
+
+    def replay(record):
+        if record['rows'] == [0]:
+            raise DataError('COPY', {}, Exception('bad value'))
+
+    assert spool.drain(replay) == (1, 1)
+    with open(spool.rejected_path, 'rb') as file:
+        assert file.read() == b'{"rows":[0]}\n'
+
+
+def test_spool_is_capped(tmp_path):
+    spool = Spool(str(tmp_path / 'spool.jsonl'), max_bytes=30)
+    assert spool.append({'rows': [1, 2, 3]})
+    assert not spool.append({'rows': [1, 2, 3]})
+    spool.close()
+
+
+def test_bulk_insert_spools_when_database_is_down(spool, monkeypatch):
+    def begin():
+        raise unavailable()
+
+    monkeypatch.setattr(utils, 'get_spool', lambda: spool)
+    monkeypatch.setattr(utils.engine, 'begin', begin)
+    rows = [{'timestamp': datetime.datetime(2023, 10, 14, 21, 0),
+             'city': 1, 'temp': 285.0}]
+    result = utils.bulk_insert_to_db(WeatherFactModel, rows)
+    assert result.spooled == 1
+
+    replayed = []
+    monkeypatch.setattr(utils, 'bulk_insert_to_db',
+                        lambda model, data, spool, **options:
+                        replayed.append((model, data, options)))
+    assert spool.drain(utils.replay_spooled) == (1, 0)
+    assert replayed == [(WeatherFactModel, rows,
+                         {'method': 'copy', 'on_conflict': 'nothing'})]
+
+
+def test_outdated_spooled_refresh_is_not_replayed(monkeypatch):
+    replayed = []
+    monkeypatch.setattr(utils, 'refresh_in_db',
+                        lambda model, data, spool, **options:
+                        replayed.append(data))
+    monkeypatch.setattr(utils, 'last_refresh',
+                        {('weather_forecast', 1): 200.0})
+    rows = [{'timestamp': '2023-10-14T21:00:00', 'city': city, 'temp': 1.0}
+            for city in (1, 2)]
+    utils.replay_spooled({'table': 'weather_forecast',
+                          'operation': 'refresh', 'spooled_at': 100.0,
+                          'options': {'scope': 'city', 'method': 'copy'},
+                          'rows': rows})
+    assert [row['city'] for row in replayed[0]] == [2]
+    assert replayed[0][0]['timestamp'] == datetime.datetime(2023, 10, 14, 21)
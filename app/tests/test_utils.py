@@ -1,9 +1,13 @@
 import sys
+from contextlib import nullcontext
+
+from sqlalchemy.dialects import postgresql
 
 sys.path.append('app/')
 
+import utils
 from db.schemas import ConditionSchema
-from utils import read_file, validate_response
+from utils import read_file, upsert_cities, validate_response
 
 
 def test_validate_response_valid_input_returns_dict():
@@ -34,3 +38,32 @@ def test_read_file_invalid_input_returns_empty_dict():
     filename = ''
     result = read_file(filename)
     assert result == {}
+
+
+def test_upsert_cities_sets_query_name_of_known_cities(monkeypatch):
+    statements = []
+
+    class Connection:
+        def execute(self, statement):
+            statements.append(statement)
+            return self
+
+        rowcount = 2
+
+    monkeypatch.setattr(utils.engine, 'begin',
+                        lambda: nullcontext(Connection()))
+    city = {'name': 'Delhi', 'country': 'IN', 'latitude': 28.6,
+            'longitude': 77.2, 'state': None}
+    assert upsert_cities([{**city, 'query_name': 'Delhi'},
+                          {**city, 'query_name': 'New Delhi'},
+                          {**city, 'name': 'Cairo', 'country': 'EG',
+                           'query_name': 'Cairo'}]) == 2
+
+    sql = ' '.join(str(statements[0].compile(
+        dialect=postgresql.dialect())).split())
+    assert ('ON CONFLICT (name, country) DO UPDATE SET query_name = '
+            'excluded.query_name WHERE cities.query_name IS NULL') in sql
+    params = statements[0].compile(dialect=postgresql.dialect()).params
+    assert params['query_name_m0'] == 'New Delhi'
+    assert params['query_name_m1'] == 'Cairo'
+    assert 'query_name_m2' not in params
@@ -1,13 +1,27 @@
 import datetime
+import json
+import multiprocessing
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
+import numpy as np
 import pytest
+import requests
 
 sys.path.append('app/')
 
+from db.models import CityModel
 from exceptions import APIConnectionException, BadResponseStatusException
+from ratelimit import RateLimiter
+from respcache import ResponseCache
+from retry import Deadline, RetryPolicy
+from settings import FORECAST_BASE_URL, HTTP_POOL_MAXSIZE
+import workers
 from utils import read_file
-from workers import CityFetcher, ForecastFetcher, WeatherFetcher
+from workers import (BatchWeatherFetcher, CityFetcher, ForecastFetcher,
+                     WeatherFetcher, get_http_session, run_concurrently,
+                     run_streaming)
 
 
 def test_get_api_response_valid_response_is_returned_as_dict(requests_mock):
@@ -22,7 +36,7 @@ def test_get_api_response_valid_response_is_returned_as_dict(requests_mock):
 def test_get_api_response_connection_error_raises_exception(prm):
     fetcher = WeatherFetcher(1, 1, 1, 1)
     fetcher.url = prm
-    fetcher.request_timeout = 0
+    fetcher.retry_policy = RetryPolicy(backoff_base=0)
     with pytest.raises(APIConnectionException):
         fetcher._get_api_response()
 
@@ -32,6 +46,50 @@ def test_get_api_response_bad_status_code_raises_exception(requests_mock):
     requests_mock.get(fetcher.url, status_code=404)
     with pytest.raises(BadResponseStatusException):
         fetcher._get_api_response()
+    assert requests_mock.call_count == 1
+
+
+def test_get_api_response_server_error_is_retried(requests_mock):
+    fetcher = WeatherFetcher(1, 1, 1, 1,
+                             retry_policy=RetryPolicy(backoff_base=0))
+    expected = {'result': 'mock'}
+    requests_mock.get(fetcher.url, [{'status_code': 503},
+                                    {'json': expected, 'status_code': 200}])
+    assert fetcher._get_api_response() == expected
+    assert requests_mock.call_count == 2
+
+
+def test_get_api_response_server_error_exhausts_retries(requests_mock):
+    fetcher = WeatherFetcher(1, 1, 1, 1,
+                             retry_policy=RetryPolicy(backoff_base=0))
+    requests_mock.get(fetcher.url, status_code=500)
+    with pytest.raises(BadResponseStatusException):
+        fetcher._get_api_response()
+    assert requests_mock.call_count == fetcher.retry_policy.max_attempts
+
+
+def test_get_api_response_expired_deadline_raises_exception(requests_mock):
+    fetcher = WeatherFetcher(1, 1, 1, 1, deadline=Deadline(0))
+    requests_mock.get(fetcher.url, json={})
+    with pytest.raises(APIConnectionException):
+        fetcher._get_api_response()
+    assert requests_mock.call_count == 0
+
+
+def test_get_api_response_limiter_wait_past_deadline_raises_exception(
+        requests_mock):
+    fetcher = WeatherFetcher(1, 1, 1, 1, deadline=Deadline(0.2))
+    fetcher.rate_limiter = RateLimiter(calls_per_minute=1)
+    fetcher.rate_limiter.acquire()
+    requests_mock.get(fetcher.url, json={})
+    with pytest.raises(APIConnectionException):
+        fetcher._get_api_response()
+    assert requests_mock.call_count == 0
+    assert fetcher.run == []
+
+
+def test_retry_policy_never_returns_zero_timeout():
+    assert min(RetryPolicy().timeout(Deadline(0))) > 0
 
 
 def test_weather_fetcher_process_response_returns_valid_data():
@@ -57,6 +115,32 @@ def test_weather_fetcher_process_response_returns_valid_data():
     assert result == expected
 
 
+def test_weather_fetcher_process_response_remembers_owm_id():
+    fetcher = WeatherFetcher(1, 1, 1, 1)
+    response = read_file('app/tests/fixture_files/sample_weather.json')
+    fetcher._process_response(response)
+    assert fetcher.owm_id == 2643743
+
+
+def test_batch_weather_fetcher_splits_cities_into_chunks():
+    cities = [CityModel(id=i, owm_id=1000 + i) for i in range(45)]
+    fetchers = BatchWeatherFetcher.for_cities(1, cities, batch_size=20)
+    assert [len(f.city_ids) for f in fetchers] == [20, 20, 5]
+    assert fetchers[2].params['id'] == '1040,1041,1042,1043,1044'
+
+
+def test_batch_weather_fetcher_process_response_fans_out_per_city():
+    cities = [CityModel(id=1, owm_id=2643743),
+              CityModel(id=2, owm_id=524901),
+              CityModel(id=3, owm_id=524901)]
+    fetcher = BatchWeatherFetcher(1, cities)
+    response = read_file('app/tests/fixture_files/sample_group.json')
+    result = fetcher._process_response(response)
+    assert [r['city'] for r in result] == [1, 2, 3]
+    assert result[0]['temp'] == 283.49
+    assert result[1]['temp'] == result[2]['temp'] == 279.1
+
+
 def test_forecast_fetcher_process_response_returns_valid_data():
     fetcher = ForecastFetcher(1, 1, 1, 1)
     filename = 'app/tests/fixture_files/sample_forecast.json'
@@ -121,6 +205,17 @@ def test_weather_fetcher_process_response_invalid_data_returns_empty_list(prm):
     assert result == []
 
 
+@pytest.mark.parametrize('prm', [{'invalid': 'response'},
+                                 {'list': [{'invalid': 'response'}]},
+                                 123,
+                                 'invalid_response',
+                                 None])
+def test_batch_fetcher_process_response_invalid_data_returns_empty_list(prm):
+    fetcher = BatchWeatherFetcher(1, [CityModel(id=1, owm_id=1)])
+    result = fetcher._process_response(prm)
+    assert result == []
+
+
 @pytest.mark.parametrize('prm', [{'invalid': 'response'},
                                  [{'invalid': 'response'}],
                                  123,
@@ -130,3 +225,177 @@ def test_forecast_fetcher_process_response_invalid_data_return_empty_list(prm):
     fetcher = ForecastFetcher(1, 1, 1, 1)
     result = fetcher._process_response(prm)
     assert result == []
+
+
+def test_run_concurrently_returns_results_in_fetchers_order(requests_mock):
+    weather = WeatherFetcher(1, 1, 1, 1)
+    forecast = ForecastFetcher(1, 1, 1, 1)
+    requests_mock.get(weather.url, json={'invalid': 'response'})
+    requests_mock.get(forecast.url, json=read_file(
+        'app/tests/fixture_files/sample_forecast.json'))
+    result = run_concurrently([weather, forecast, weather], concurrency=2)
+    assert len(result) == 3
+    assert result[0] == [] and result[2] == []
+    assert len(result[1]) == 40
+
+
+def test_get_http_session_returns_shared_pooled_session():
+    session = get_http_session()
+    assert session is get_http_session()
+    adapter = session.get_adapter('http://api.openweathermap.org')
+    assert adapter._pool_maxsize == HTTP_POOL_MAXSIZE
+
+
+def test_get_api_response_retries_after_too_many_requests(requests_mock):
+    fetcher = WeatherFetcher(1, 1, 1, 1)
+    fetcher.rate_limiter = RateLimiter()
+    expected = {'result': 'mock'}
+    requests_mock.get(fetcher.url, [
+        {'status_code': 429, 'headers': {'Retry-After': '0'}},
+        {'json': expected, 'status_code': 200}])
+    result = fetcher._get_api_response()
+    assert result == expected
+    assert requests_mock.call_count == 2
+
+
+def test_forecast_fetcher_skips_unchanged_payload(requests_mock):
+    cache = ResponseCache()
+    response = read_file('app/tests/fixture_files/sample_forecast.json')
+    requests_mock.get(FORECAST_BASE_URL, json=response)
+    results = []
+    for _ in range(2):
+        fetcher = ForecastFetcher(1, 1, 1, 1)
+        fetcher.response_cache = cache
+        results.append(fetcher.run)
+        cache.commit([1])
+    assert results[0] and results[1] == []
+    assert cache.pop_stats() == (1, 2)
+
+
+def test_forecast_fetcher_refetches_until_committed(requests_mock):
+    cache = ResponseCache()
+    response = read_file('app/tests/fixture_files/sample_forecast.json')
+    requests_mock.get(FORECAST_BASE_URL, json=response,
+                      headers={'ETag': '"v1"'})
+    for _ in range(2):
+        fetcher = ForecastFetcher(1, 1, 1, 1)
+        fetcher.response_cache = cache
+        assert fetcher.run
+        assert 'If-None-Match' not in requests_mock.last_request.headers
+    assert cache.pop_stats() == (0, 2)
+
+
+def test_forecast_fetcher_sends_etag_and_handles_not_modified(
+        requests_mock):
+    cache = ResponseCache()
+    response = read_file('app/tests/fixture_files/sample_forecast.json')
+    requests_mock.get(FORECAST_BASE_URL, [
+        {'json': response, 'headers': {'ETag': '"v1"'}},
+        {'status_code': 304}])
+    results = []
+    for _ in range(2):
+        fetcher = ForecastFetcher(1, 1, 1, 1)
+        fetcher.response_cache = cache
+        results.append(fetcher.run)
+        cache.commit([1])
+    assert results[0] and results[1] == []
+    assert requests_mock.last_request.headers['If-None-Match'] == '"v1"'
+
+
+def test_forecast_fetcher_refetches_when_entry_expires_in_flight(
+        requests_mock, monkeypatch):
+    cache = ResponseCache(max_age_sec=60)
+    response = read_file('app/tests/fixture_files/sample_forecast.json')
+    requests_mock.get(FORECAST_BASE_URL, [
+        {'json': response, 'headers': {'ETag': '"v1"'}},
+        {'status_code': 304},
+        {'json': response, 'headers': {'ETag': '"v1"'}}])
+    fetcher = ForecastFetcher(1, 1, 1, 1)
+    fetcher.response_cache = cache
+    assert fetcher.run
+    cache.commit([1])
+    headers = cache.request_headers(1)
+    monkeypatch.setattr(cache, 'request_headers', lambda key: headers)
+    monkeypatch.setattr('respcache.time.time', lambda: 1e12)
+
+    fetcher = ForecastFetcher(1, 1, 1, 1)
+    fetcher.response_cache = cache
+    assert fetcher.run
+    history = requests_mock.request_history
+    assert history[1].headers['If-None-Match'] == '"v1"'
+    assert 'If-None-Match' not in history[2].headers
+
+
+def test_response_cache_expires_entries(monkeypatch):
+    cache = ResponseCache(max_age_sec=60)
+    response = requests.Response()
+    response._content = b'{}'
+    assert not cache.unchanged('key', response)
+    cache.commit(['key'])
+    assert cache.unchanged('key', response)
+    monkeypatch.setattr('respcache.time.time', lambda: 1e12)
+    assert not cache.unchanged('key', response)
+
+
+def test_run_streaming_hands_results_to_sink(requests_mock):
+    requests_mock.get(WeatherFetcher(1, 1, 1, 1).url, json=read_file(
+        'app/tests/fixture_files/sample_weather.json'))
+    fetchers = [WeatherFetcher(1, i, 1, 1) for i in range(5)]
+    received = []
+    assert run_streaming(fetchers, lambda f, rows: received.append(
+        (f.city_id, rows[0]['city']))) is None
+    assert sorted(received) == [(i, i) for i in range(5)]
+
+
+@pytest.fixture(scope='module')
+def cpu_pool():
+    with ProcessPoolExecutor(
+            1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        yield pool
+
+
+@pytest.mark.parametrize('fetcher, fixture', [
+    (WeatherFetcher(1, 1, 1, 1), 'sample_weather.json'),
+    (ForecastFetcher(1, 1, 1, 1), 'sample_forecast.json'),
+])
+def test_cpu_pool_returns_validated_batch(requests_mock, cpu_pool, fetcher,
+                                          fixture):
+    response = read_file('app/tests/fixture_files/' + fixture)
+    requests_mock.get(fetcher.url, json=response)
+    fetcher.response_cache = None
+    fetcher.columnar = True
+    expected, _ = fetcher._process_response(response).validated()
+    fetcher.owm_id = None
+
+    fetcher.cpu_pool = cpu_pool
+    batch = fetcher.run
+    assert len(batch) == len(expected) > 0
+    for name, column in expected.columns.items():
+        assert np.array_equal(batch.columns[name], column)
+        assert np.array_equal(batch.nulls[name], expected.nulls[name])
+    if isinstance(fetcher, WeatherFetcher):
+        assert fetcher.owm_id == 2643743
+
+
+def test_broken_cpu_pool_is_replaced_next_cycle(monkeypatch, cpu_pool):
+    class BrokenPool:
+        shut_down = False
+
+        def submit(self, *args):
+            raise BrokenProcessPool('worker died')
+
+        def shutdown(self, **kwargs):
+            self.shut_down = True
+
+    broken = BrokenPool()
+    monkeypatch.setattr(workers, '_cpu_pool', broken)
+    response = read_file('app/tests/fixture_files/sample_weather.json')
+    fetcher = WeatherFetcher(1, 1, 1, 1)
+    fetcher.columnar = True
+    fetcher.cpu_pool = workers.get_cpu_pool(1)
+    assert len(fetcher._process_in_pool(json.dumps(response).encode())) == 1
+    assert broken.shut_down and fetcher.cpu_pool is None
+    monkeypatch.setattr(workers, '_cpu_pool', None)
+    monkeypatch.setattr(workers, 'ProcessPoolExecutor',
+                        lambda **kwargs: cpu_pool)
+    assert workers.get_cpu_pool(1) is cpu_pool
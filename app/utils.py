@@ -1,16 +1,41 @@
 import json
+import time
+from datetime import datetime, timezone
 from functools import wraps
 from typing import Optional
 
-from db.models import CityModel
-from db.session import get_session
+from db.bulk import WriteResult, refresh_rows, write_rows
+from db.models import Base, CityModel, WeatherFactModel
+from db.partitions import (add_months, drop_expired_partitions,
+                           ensure_partitions, month_start)
+from db.rollups import rebuild_rollups, update_rollups
+from db.session import engine, get_session
+from db.spool import get_spool
+from metrics import DB_WRITE_LATENCY, ROWS_WRITTEN
 from pydantic._internal._model_construction import \
     ModelMetaclass as PydanticSchema
-from settings import logger
-from sqlalchemy import insert
-from sqlalchemy.exc import IntegrityError
+from settings import (BULK_WRITE_METHOD, ON_CONFLICT_MODE,
+                      PARTITION_PRECREATE_MONTHS, ROLLUPS_ENABLED,
+                      WEATHER_FACT_RETENTION_MONTHS, logger)
+from sqlalchemy import DateTime, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.orm.decl_api import DeclarativeMeta as SQLAlchemy_Model
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson parses straight from bytes, json.loads decodes them to str first
+json_loads = orjson.loads if orjson else json.loads
+
+MODELS = {mapper.class_.__tablename__: mapper.class_
+          for mapper in Base.registry.mappers}
+
+# when each (table, scope value) was last refreshed by a live write
+last_refresh: dict[tuple[str, object], float] = {}
+
 
 def log(mode):
     logger_modes = {
@@ -29,16 +54,185 @@ def log(mode):
     return outer
 
 
+def measure_write(operation: str):
+    def outer(func):
+        @wraps(func)
+        def inner(model, data, *args, **kwargs):
+            started = time.perf_counter()
+            result = func(model, data, *args, **kwargs)
+            if len(data):
+                table = model.__tablename__
+                DB_WRITE_LATENCY.observe(time.perf_counter() - started,
+                                         table, operation)
+                for outcome, count in zip(result._fields, result):
+                    if count:
+                        ROWS_WRITTEN.inc(table, outcome, amount=count)
+            return result
+        return inner
+    return outer
+
+
+def column_values(data: list[dict], name: str) -> list:
+    if hasattr(data, 'columns'):
+        return data.columns[name].tolist()
+    return [row[name] for row in data]
+
+
+def spool_rows(model: SQLAlchemy_Model, operation: str, data: list[dict],
+               options: dict, err: Exception) -> WriteResult:
+    logger.error('failed writing to database, spooling %d %s rows: %s',
+                 len(data), model.__tablename__, err)
+    record = {'table': model.__tablename__, 'operation': operation,
+              'options': options, 'spooled_at': time.time(),
+              'rows': list(data)}
+    if get_spool().append(record):
+        return WriteResult(spooled=len(data))
+    return WriteResult(skipped=len(data))
+
+
+def replay_spooled(record: dict) -> None:
+    model = MODELS[record['table']]
+    rows = record['rows']
+    if record['operation'] == 'refresh':
+        # a refresh replaces the rows of its cities, an older one must not
+        # overwrite what a later cycle has already written
+        scope = record['options']['scope']
+        rows = [row for row in rows
+                if last_refresh.get((record['table'], row[scope]), 0)
+                < record['spooled_at']]
+        if not rows:
+            logger.debug('skipped outdated spooled refresh of %s',
+                         record['table'])
+            return
+    # spooled timestamps come back as ISO strings
+    datetimes = [c.name for c in model.__table__.columns
+                 if isinstance(c.type, DateTime)]
+    for row in rows:
+        for name in datetimes:
+            if isinstance(row.get(name), str):
+                row[name] = datetime.fromisoformat(row[name])
+    write = (bulk_insert_to_db if record['operation'] == 'insert'
+             else refresh_in_db)
+    write(model, rows, spool=False, **record['options'])
+
+
+@log('debug')
+def drain_spool() -> None:
+    spool = get_spool()
+    spool.sync()
+    replayed, rejected = spool.drain(replay_spooled)
+    if replayed or rejected:
+        logger.info('replayed %d spooled writes, rejected %d',
+                    replayed, rejected)
+
+
 @log('debug')
-def bulk_insert_to_db(model: SQLAlchemy_Model, data: list[dict]) -> None:
+@measure_write('insert')
+def bulk_insert_to_db(model: SQLAlchemy_Model, data: list[dict],
+                      method: str = BULK_WRITE_METHOD,
+                      on_conflict: Optional[str] = ON_CONFLICT_MODE,
+                      spool: bool = True) -> WriteResult:
     if not data:
         logger.debug('failed writing to database: got empty list')
-        return
+        return WriteResult()
     try:
-        with get_session() as session:
-            session.execute(insert(model), data)
+        with engine.begin() as connection:
+            result = write_rows(connection, model.__table__, data,
+                                method, on_conflict)
+            if (ROLLUPS_ENABLED and model is WeatherFactModel
+                    and (result.inserted or result.updated)):
+                update_rollups(connection, data)
     except IntegrityError as err:
         logger.error('failed writing to database: %s', err)
+        return WriteResult(skipped=len(data))
+    except SQLAlchemyError as err:
+        if not spool:
+            raise
+        return spool_rows(model, 'insert', data,
+                          {'method': method, 'on_conflict': on_conflict}, err)
+
+    logger.debug('%s: inserted %d, updated %d, skipped %d, deleted %d rows',
+                 model.__tablename__, *result[:4])
+    return result
+
+
+@log('debug')
+@measure_write('refresh')
+def refresh_in_db(model: SQLAlchemy_Model, data: list[dict],
+                  scope: str = 'city',
+                  method: str = BULK_WRITE_METHOD,
+                  spool: bool = True) -> WriteResult:
+    if not data:
+        logger.debug('failed refreshing database: got empty list')
+        return WriteResult()
+    try:
+        with engine.begin() as connection:
+            result = refresh_rows(connection, model.__table__, data,
+                                  scope, method)
+    except IntegrityError as err:
+        logger.error('failed writing to database: %s', err)
+        return WriteResult(skipped=len(data))
+    except SQLAlchemyError as err:
+        if not spool:
+            raise
+        return spool_rows(model, 'refresh', data,
+                          {'scope': scope, 'method': method}, err)
+    if spool:
+        refreshed_at = time.time()
+        for value in set(column_values(data, scope)):
+            last_refresh[model.__tablename__, value] = refreshed_at
+
+    logger.debug('%s: inserted %d, updated %d, skipped %d, deleted %d rows',
+                 model.__tablename__, *result[:4])
+    return result
+
+
+@log('debug')
+def maintain_partitions(timestamp: float) -> None:
+    table_name = WeatherFactModel.__tablename__
+    today = datetime.fromtimestamp(timestamp, timezone.utc).date()
+    months = [add_months(month_start(today), i)
+              for i in range(PARTITION_PRECREATE_MONTHS + 1)]
+    # the partitions are created months ahead, a cycle can still write
+    # while the database refuses this
+    try:
+        with engine.begin() as connection:
+            created = ensure_partitions(connection, table_name, months)
+            dropped = []
+            if WEATHER_FACT_RETENTION_MONTHS:
+                dropped = drop_expired_partitions(
+                    connection, table_name, WEATHER_FACT_RETENTION_MONTHS,
+                    today)
+    except SQLAlchemyError as err:
+        logger.error('failed maintaining partitions: %s', err)
+        return
+    if created:
+        logger.info('created partitions: %s', ', '.join(created))
+    if dropped:
+        logger.info('dropped expired partitions: %s', ', '.join(dropped))
+
+
+@log('info')
+def backfill_rollups() -> None:
+    timestamp = WeatherFactModel.timestamp
+    with engine.connect() as connection:
+        first, last = connection.execute(
+            select(func.min(timestamp), func.max(timestamp))).one()
+    if first is None:
+        logger.info('nothing to roll up: weather_fact is empty')
+        return
+
+    month = month_start(first.date())
+    while month <= last.date():
+        next_month = add_months(month, 1)
+        with engine.begin() as connection:
+            updated = rebuild_rollups(
+                connection,
+                datetime.combine(month, datetime.min.time()),
+                datetime.combine(next_month, datetime.min.time()))
+        logger.info('rolled up %s: %d buckets', month.strftime('%Y-%m'),
+                    updated)
+        month = next_month
 
 
 def read_file(filename: str) -> dict:
@@ -57,15 +251,51 @@ def read_file(filename: str) -> dict:
 def validate_response(schema: PydanticSchema,
                       response: dict) -> Optional[dict]:
     try:
-        valid_response = schema(**response)
+        valid_response = schema.model_validate(response)
     except ValueError as err:
         logger.error('response validation error: %s', err)
     else:
         return valid_response.model_dump()
 
 
-def get_cities_list() -> list[CityModel]:
+def get_geocoded_names() -> set[str]:
+    # cities loaded before query_name existed are matched by their name
     with get_session() as session:
-        cities = session.query(CityModel).all()
-        session.expunge_all()
-    return cities
+        rows = session.execute(select(CityModel.query_name, CityModel.name))
+        return {query_name or name for query_name, name in rows}
+
+
+def upsert_cities(data: list[dict]) -> int:
+    # a city found under another spelling, or loaded before query_name
+    # existed, keeps its row and gets the name it was just found by
+    # two names of one city in a chunk would hit the same row twice
+    rows = list({(row['name'], row['country']): row
+                 for row in data}.values())
+    if not rows:
+        return 0
+    stmt = insert(CityModel).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['name', 'country'],
+        set_={'query_name': stmt.excluded.query_name},
+        where=CityModel.query_name.is_(None))
+    try:
+        with engine.begin() as connection:
+            return connection.execute(stmt).rowcount
+    except IntegrityError as err:
+        logger.error('failed writing cities: %s', err)
+        return 0
+
+
+def set_cities_owm_ids(owm_ids: dict[int, int]) -> None:
+    if not owm_ids:
+        return
+    # only a shortcut for the next cycle, which can just as well fetch
+    # these cities one by one again
+    try:
+        with get_session() as session:
+            session.execute(update(CityModel), [
+                {'id': city_id, 'owm_id': owm_id}
+                for city_id, owm_id in owm_ids.items()])
+    except SQLAlchemyError as err:
+        logger.error('failed saving owm ids of %d cities: %s',
+                     len(owm_ids), err)
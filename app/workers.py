@@ -1,27 +1,116 @@
-import json
+import asyncio
+import multiprocessing
+import threading
 import time
 from abc import ABC, abstractmethod
+from concurrent.futures import (Executor, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime as dt
-from typing import Optional
+from http import HTTPStatus
+from typing import Callable, Optional
 
 import requests
-from db.schemas import CitySchema, WeatherSchema
-from exceptions import APIConnectionException, BadResponseStatusException
-from requests.exceptions import ConnectionError, MissingSchema, ReadTimeout
-from settings import (API_KEY, CITY_DATA_BASE_URL, FORECAST_BASE_URL,
-                      MAX_REQUEST_RETRIES, REQUEST_TIMEOUT_SEC,
-                      WEATHER_BASE_URL, logger)
-from utils import log, validate_response
+from db.batch import WeatherBatch
+from db.models import CityModel
+from db.schemas import CitySchema, validate_weather_rows
+from exceptions import (APIConnectionException, BadResponseStatusException,
+                        ResponseUnchangedException)
+from geocache import get_geocache
+from metrics import (API_LATENCY, API_RESPONSES, API_RETRIES,
+                     VALIDATION_FAILURES, timed)
+from ratelimit import RateLimiter, parse_retry_after, rate_limiter
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, RequestException, Timeout
+from respcache import ResponseCache, forecast_cache
+from retry import DEFAULT_RETRY_POLICY, Deadline, RetryPolicy
+from settings import (API_KEY, CITY_DATA_BASE_URL, CPU_WORKERS,
+                      FETCH_CONCURRENCY,
+                      FORECAST_BASE_URL, GROUP_BASE_URL, HTTP_KEEP_ALIVE,
+                      HTTP_POOL_BLOCK, HTTP_POOL_CONNECTIONS,
+                      HTTP_POOL_MAXSIZE, MAX_BATCH_SIZE, WEATHER_BASE_URL,
+                      logger)
+from utils import json_loads, log, validate_response
+
+EMPTY: dict = {}
+
+_http_session: Optional[requests.Session] = None
+_http_session_lock = threading.Lock()
+
+_cpu_pool: Optional[Executor] = None
+_cpu_pool_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                _http_session = _create_http_session()
+    return _http_session
+
+
+def _create_http_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS,
+                          pool_maxsize=HTTP_POOL_MAXSIZE,
+                          pool_block=HTTP_POOL_BLOCK)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if not HTTP_KEEP_ALIVE:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def get_cpu_pool(workers: int = CPU_WORKERS) -> Optional[Executor]:
+    # spawn rather than fork, the parent runs fetch and writer threads
+    global _cpu_pool
+    if _cpu_pool is None and workers > 0:
+        with _cpu_pool_lock:
+            if _cpu_pool is None:
+                _cpu_pool = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context('spawn'))
+                logger.debug('started %d CPU worker processes', workers)
+    return _cpu_pool
+
+
+def reset_cpu_pool(pool: Executor) -> bool:
+    global _cpu_pool
+    with _cpu_pool_lock:
+        if _cpu_pool is not pool:
+            return False
+        _cpu_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+    return True
+
+
+def _process_in_worker(fetcher: 'Fetcher', content: bytes) -> tuple:
+    # runs in a pool process: only the fetcher's own attributes and the raw
+    # bytes come in, a validated batch of numpy arrays goes back
+    fetcher.columnar = True
+    batch = fetcher._process_response(json_loads(content))
+    errors: dict[str, int] = {}
+    if len(batch):
+        batch, errors = batch.validated()
+    return batch, errors, getattr(fetcher, 'owm_id', None)
 
 
 class Fetcher(ABC):
-    request_timeout: int = REQUEST_TIMEOUT_SEC
+    rate_limiter: RateLimiter = rate_limiter
+    response_cache: Optional[ResponseCache] = None
+    columnar: bool = False
+    cpu_pool: Optional[Executor] = None
 
     def __init__(self, timestamp: Optional[float] = None,
                  city_id: Optional[int] = None,
                  lat: Optional[float] = None,
                  lon: Optional[float] = None,
-                 city_name: Optional[str] = None) -> None:
+                 city_name: Optional[str] = None,
+                 retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+                 deadline: Optional[Deadline] = None) -> None:
+        self.retry_policy = retry_policy
+        self.deadline = deadline
         self.timestamp = timestamp
         self.city_name = city_name
         self.city_id = city_id
@@ -32,77 +121,172 @@ class Fetcher(ABC):
         }
 
     @log('debug')
-    def _get_api_response(self) -> dict:
+    def _get_api_response(self, raw: bool = False) -> dict:
         logger.debug('sending request to %s with parameters: %s',
                      self.url, self.params)
 
-        retry_counter = MAX_REQUEST_RETRIES
-        while retry_counter:
+        policy = self.retry_policy
+        deadline = Deadline(policy.request_deadline, parent=self.deadline)
+        # one cache per endpoint, the writes commit its entries by city
+        cache_key = self.city_id if self.response_cache else None
+        headers = (self.response_cache.request_headers(cache_key)
+                   if self.response_cache else None)
+        endpoint = self.url.rsplit('/', 1)[-1]
+        response, error_data = None, None
+        for attempt in range(policy.max_attempts):
+            if deadline.expired:
+                error_data = 'deadline exceeded'
+                break
+
+            # the limiter may not wait past the deadline, and the deadline
+            # may have run out while it waited
+            if (not self.rate_limiter.acquire(deadline.remaining())
+                    or deadline.expired):
+                error_data = 'deadline exceeded waiting for rate limit'
+                break
             try:
-                response = requests.get(url=self.url, params=self.params)
+                with timed(API_LATENCY, endpoint):
+                    response = get_http_session().get(
+                        url=self.url, params=self.params, headers=headers,
+                        timeout=policy.timeout(deadline))
+            except (ConnectionError, Timeout) as err:
+                response, error_data = None, err
+                API_RESPONSES.inc(endpoint, 'error')
+            except RequestException as err:
+                response, error_data = None, err
+                API_RESPONSES.inc(endpoint, 'error')
+                break
+            else:
+                API_RESPONSES.inc(endpoint, str(response.status_code))
+                if (headers
+                        and response.status_code == HTTPStatus.NOT_MODIFIED
+                        and not self.response_cache.fresh(cache_key)):
+                    # the entry expired while the request was out and a 304
+                    # has no body to fall back on, ask again in full
+                    headers, response = None, None
+                    error_data = 'not modified, but nothing cached'
+                    continue
+                if not policy.is_retryable_status(response.status_code):
+                    break
+                error_data = f'status {response.status_code}'
+
+            if attempt + 1 == policy.max_attempts:
                 break
-            except (ConnectionError, MissingSchema, ReadTimeout) as err:
-                error_data = err
-                retry_counter -= 1
-                if retry_counter:
-                    time.sleep(self.request_timeout)
+            API_RETRIES.inc(endpoint)
+            delay = policy.backoff(attempt)
+            logger.debug('retrying %s in %.1f sec: %s',
+                         self.url, delay, error_data)
+            if (response is not None
+                    and response.status_code == HTTPStatus.TOO_MANY_REQUESTS):
+                self.rate_limiter.back_off(parse_retry_after(
+                    response.headers.get('Retry-After'), delay))
+            else:
+                time.sleep(min(delay, deadline.remaining()))
 
-        if not retry_counter:
+        if response is None:
             logger.debug('request error at: %s, %s', self.url, error_data)
             raise APIConnectionException
 
         logger.debug(f'response {response.status_code} from {self.url}')
         if response.ok:
-            return json.loads(response.text)
+            if (self.response_cache
+                    and self.response_cache.unchanged(cache_key, response)):
+                raise ResponseUnchangedException
+            if response.status_code != HTTPStatus.NOT_MODIFIED:
+                if raw:
+                    return response.content
+                return json_loads(response.content)
 
         logger.debug('Bad response status %d at: %s',
                      response.status_code, self.url)
         raise BadResponseStatusException
 
-    def _construct_mapping(self, item: dict) -> dict:
+    def _construct_mapping(self, item: dict, city_id: Optional[int] = None,
+                           timestamp: Optional[float] = None) -> dict:
         if not isinstance(item, dict):
             logger.debug('invalid response type from %s', self.url)
             return {}
 
-        processed_response = {
-            'city': self.city_id
+        # one dict literal per item, sections missing from the payload map
+        # to None and are left to the schema
+        weather = item.get('weather')
+        condition = (weather[0] if weather and isinstance(weather, list)
+                     else EMPTY)
+        main = item.get('main') or EMPTY
+        wind = item.get('wind') or EMPTY
+        if timestamp is None and 'dt' in item:
+            timestamp = dt.fromtimestamp(item['dt'])
+        return {
+            'city': self.city_id if city_id is None else city_id,
+            'condition': condition.get('id'),
+            'temp': main.get('temp'),
+            'temp_min': main.get('temp_min'),
+            'temp_max': main.get('temp_max'),
+            'pressure': main.get('pressure'),
+            'humidity': main.get('humidity'),
+            'wind_speed': wind.get('speed'),
+            'wind_direction': wind.get('deg'),
+            'wind_gust': wind.get('gust'),
+            'clouds': (item.get('clouds') or EMPTY).get('all'),
+            'timestamp': timestamp,
         }
 
-        if 'weather' in item:
-            w = item['weather']
-            if w and isinstance(w, list):
-                processed_response['condition'] = w[0].get('id')
-
-        if 'main' in item:
-            m = item['main']
-            processed_response['temp'] = m.get('temp')
-            processed_response['temp_min'] = m.get('temp_min')
-            processed_response['temp_max'] = m.get('temp_max')
-            processed_response['pressure'] = m.get('pressure')
-            processed_response['humidity'] = m.get('humidity')
-
-        if 'wind' in item:
-            w = item['wind']
-            processed_response['wind_speed'] = w.get('speed')
-            processed_response['wind_direction'] = w.get('deg')
-            processed_response['wind_gust'] = w.get('gust')
-
-        if 'clouds' in item:
-            processed_response['clouds'] = item['clouds'].get('all')
-
-        if 'dt' in item:
-            processed_response['timestamp'] = dt.fromtimestamp(item['dt'])
-
-        return processed_response
+    # the whole response is validated in one call, invalid rows are dropped
+    # and logged one by one; columnar fetchers leave validation to the
+    # batch of the whole cycle
+    def _validate(self, rows: list[dict]) -> list[dict]:
+        if not rows:
+            return []
+        if self.columnar:
+            return WeatherBatch.from_rows(rows)
+        valid, errors = validate_weather_rows(rows)
+        for error in errors:
+            VALIDATION_FAILURES.inc(error.field or 'row')
+            logger.error('response validation error from %s: row %d, %s: %s',
+                         self.url, error.index, error.field or 'row',
+                         error.message)
+        return valid
 
     @abstractmethod
     def _process_response(self, response) -> list[dict]:
         pass
 
+    def __getstate__(self) -> dict:
+        # the pool itself stays in the parent process
+        state = self.__dict__.copy()
+        state.pop('cpu_pool', None)
+        return state
+
+    def _process_in_pool(self, content: bytes) -> WeatherBatch:
+        pool = self.cpu_pool
+        try:
+            batch, errors, owm_id = pool.submit(
+                _process_in_worker, self, content).result()
+        except (BrokenProcessPool, RuntimeError) as err:
+            # the rest of the cycle falls back to threads, the next one
+            # starts a fresh pool
+            self.cpu_pool = None
+            if reset_cpu_pool(pool):
+                logger.error('CPU worker pool failed, processing in '
+                             'threads: %s', err)
+            return self._process_response(json_loads(content))
+        for field, count in errors.items():
+            VALIDATION_FAILURES.inc(field, amount=count)
+            logger.error('response validation error from %s: %d rows with '
+                         'invalid %s', self.url, count, field)
+        if owm_id is not None:
+            self.owm_id = owm_id
+        return batch
+
     @property
     def run(self) -> list[dict]:
         try:
+            if self.cpu_pool is not None:
+                return self._process_in_pool(
+                    self._get_api_response(raw=True))
             response: dict = self._get_api_response()
+        except ResponseUnchangedException:
+            logger.debug('response from %s is unchanged, skipped', self.url)
         except (APIConnectionException, BadResponseStatusException) as err:
             logger.error('API response error: %s', err)
         else:
@@ -111,15 +295,72 @@ class Fetcher(ABC):
 
         return []
 
+    # with a sink the result is handed over from the worker thread and not
+    # returned, a blocking sink slows the fetchers down
+    def _run_into(self, sink: Optional[Callable]) -> Optional[list[dict]]:
+        result = self.run
+        if sink is None:
+            return result
+        sink(self, result)
+
+    async def run_async(self, semaphore: asyncio.Semaphore,
+                        sink: Optional[Callable] = None) -> list[dict]:
+        async with semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self._run_into, sink)
+
+
+async def _gather(fetchers: list[Fetcher], concurrency: int,
+                  sink: Optional[Callable] = None) -> list[list[dict]]:
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(
+        *(f.run_async(semaphore, sink) for f in fetchers))
+
+
+@log('debug')
+def run_concurrently(fetchers: list[Fetcher],
+                     concurrency: int = FETCH_CONCURRENCY) -> list[list[dict]]:
+    if not fetchers:
+        return []
+    return asyncio.run(_gather(fetchers, max(1, concurrency)))
+
+
+@log('debug')
+def run_streaming(fetchers: list[Fetcher],
+                  sink: Callable[[Fetcher, list[dict]], None],
+                  concurrency: int = FETCH_CONCURRENCY) -> None:
+    if fetchers:
+        asyncio.run(_gather(fetchers, max(1, concurrency), sink))
+
 
 class CityFetcher(Fetcher):
-    def __init__(self, city_name: str) -> None:
+    def __init__(self, city_name: str,
+                 retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+                 deadline: Optional[Deadline] = None) -> None:
+        self.retry_policy = retry_policy
+        self.deadline = deadline
+        self.city_name = city_name
         self.url = CITY_DATA_BASE_URL
         self.params = {
             'appid': API_KEY,
             'q': city_name
         }
 
+    def _get_api_response(self) -> list[dict]:
+        cache = get_geocache()
+        response = cache.get(self.city_name)
+        if response is not None:
+            logger.debug('geocoding cache hit for %s', self.city_name)
+            return response
+
+        response = super()._get_api_response()
+        # empty answers are not cached, the name is asked again next time
+        if isinstance(response, list) and response:
+            cache.put(self.city_name, response)
+        return response
+
     def _process_response(self, response: list[dict]) -> list[dict]:
         if not isinstance(response, list):
             logger.error('processing response failed: invalid response type')
@@ -138,22 +379,72 @@ class CityFetcher(Fetcher):
 
 class WeatherFetcher(Fetcher):
     def __init__(self, timestamp: float, city_id: int,
-                 lat: float, lon: float) -> None:
-        super().__init__(timestamp, city_id, lat, lon)
+                 lat: float, lon: float,
+                 retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+                 deadline: Optional[Deadline] = None) -> None:
+        super().__init__(timestamp, city_id, lat, lon,
+                         retry_policy=retry_policy, deadline=deadline)
         self.url = WEATHER_BASE_URL
+        self.owm_id: Optional[int] = None
 
     def _process_response(self, response: dict) -> list[dict]:
-        processed_response: dict = self._construct_mapping(response)
-        processed_response['timestamp'] = self.timestamp
-        valid_response: Optional[dict] = validate_response(
-            WeatherSchema, processed_response)
-        return [valid_response] if valid_response else []
+        processed_response: dict = self._construct_mapping(
+            response, timestamp=self.timestamp)
+        if not processed_response:
+            return []
+        if isinstance(response.get('id'), int):
+            self.owm_id = response['id']
+        return self._validate([processed_response])
+
+
+class BatchWeatherFetcher(Fetcher):
+    def __init__(self, timestamp: float, cities: list[CityModel],
+                 retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+                 deadline: Optional[Deadline] = None) -> None:
+        super().__init__(timestamp, retry_policy=retry_policy,
+                         deadline=deadline)
+        self.url = GROUP_BASE_URL
+        self.city_ids: dict[int, list[int]] = {}
+        for c in cities:
+            self.city_ids.setdefault(c.owm_id, []).append(c.id)
+        self.params = {
+            'appid': API_KEY,
+            'id': ','.join(str(i) for i in self.city_ids)
+        }
+
+    @classmethod
+    def for_cities(cls, timestamp: float, cities: list[CityModel],
+                   batch_size: int = MAX_BATCH_SIZE,
+                   **kwargs) -> list['BatchWeatherFetcher']:
+        return [cls(timestamp, cities[i:i + batch_size], **kwargs)
+                for i in range(0, len(cities), batch_size)]
+
+    def _process_response(self, response: dict) -> list[dict]:
+        items = []
+        try:
+            response_items: list[dict] = response['list']
+        except (TypeError, KeyError) as err:
+            logger.error('processing response failed: %s', err)
+        else:
+            for item in response_items:
+                if not isinstance(item, dict):
+                    continue
+                for city_id in self.city_ids.get(item.get('id'), []):
+                    items.append(self._construct_mapping(
+                        item, city_id, self.timestamp))
+
+        return self._validate(items)
 
 
 class ForecastFetcher(Fetcher):
+    response_cache = forecast_cache
+
     def __init__(self, timestamp: float, city_id: int,
-                 lat: float, lon: float) -> None:
-        super().__init__(timestamp, city_id, lat, lon)
+                 lat: float, lon: float,
+                 retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+                 deadline: Optional[Deadline] = None) -> None:
+        super().__init__(timestamp, city_id, lat, lon,
+                         retry_policy=retry_policy, deadline=deadline)
         self.url = FORECAST_BASE_URL
 
     def _process_response(self, response: dict) -> list[dict]:
@@ -165,11 +456,7 @@ class ForecastFetcher(Fetcher):
         else:
             for item in response_items:
                 processed_response: dict = self._construct_mapping(item)
-                if not processed_response:
-                    continue
-                valid_item: Optional[dict] = validate_response(
-                    WeatherSchema, processed_response)
-                if valid_item:
-                    items.append(valid_item)
+                if processed_response:
+                    items.append(processed_response)
 
-        return items
+        return self._validate(items)
@@ -1,4 +1,4 @@
 (cd app/db && alembic upgrade head)
 python app/main.py --load cities
 python app/main.py --load conditions
-crond -f -L 2
\ No newline at end of file
+exec python app/main.py --daemon
\ No newline at end of file